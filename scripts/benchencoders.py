@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Compare tile encoders on a sample of real map tiles
+
+Encodes each tile in every format at each quality setting and reports the average size,
+encode time and how close the decoded tile is to the original (PSNR and SSIM), eg:
+    uv run benchencoders.py ..\\public\\tiles\\sl\\base -f jpg webp avif -Q 60 75 85 95
+"""
+
+import json
+import math
+import random
+import sys
+import time
+from argparse import ArgumentParser
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+from tilelib.encoders import available_formats, default_quality, encode_tile
+
+# SSIM constants for 8 bit images (Wang et al. 2004) and the size of the window the statistics are taken over
+ssim_c1 = (0.01 * 255) ** 2
+ssim_c2 = (0.03 * 255) ** 2
+ssim_window = 7
+
+
+# Peak signal to noise ratio in dB, inf for identical images
+def psnr(original: np.ndarray, decoded: np.ndarray) -> float:
+    mse = np.mean((original - decoded) ** 2)
+    return math.inf if mse == 0 else 10 * math.log10(255**2 / mse)
+
+
+# Mean structural similarity of the luma of two images, using a uniform window
+def ssim(original: np.ndarray, decoded: np.ndarray) -> float:
+    def local_mean(a: np.ndarray) -> np.ndarray:
+        return sliding_window_view(a, (ssim_window, ssim_window)).mean(axis=(-1, -2))
+
+    x, y = original, decoded
+    mx, my = local_mean(x), local_mean(y)
+    vx = local_mean(x * x) - mx * mx
+    vy = local_mean(y * y) - my * my
+    cxy = local_mean(x * y) - mx * my
+    s = ((2 * mx * my + ssim_c1) * (2 * cxy + ssim_c2)) / ((mx * mx + my * my + ssim_c1) * (vx + vy + ssim_c2))
+    return float(s.mean())
+
+
+def luma(image: Image.Image) -> np.ndarray:
+    return np.asarray(image.convert('L'), dtype=np.float64)
+
+
+def load_sample(paths: list[Path], count: int, seed: int) -> list[Image.Image]:
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob('*') if p.suffix.lower() in {'.png', '.jpg', '.jpeg', '.webp'}))
+        else:
+            files.append(path)
+    if len(files) > count:
+        files = random.Random(seed).sample(files, count)
+    tiles = []
+    for file in files:
+        with Image.open(file) as image:
+            tiles.append(image.convert('RGB'))
+    return tiles
+
+
+def benchmark(tiles: list[Image.Image], format: str, quality: int) -> dict:
+    size = 0
+    encode_time = 0.0
+    psnrs = []
+    ssims = []
+    for tile in tiles:
+        start = time.perf_counter()
+        data = encode_tile(tile, format, quality)
+        encode_time += time.perf_counter() - start
+        size += len(data)
+
+        with Image.open(BytesIO(data)) as decoded:
+            original = np.asarray(tile, dtype=np.float64)
+            psnrs.append(psnr(original, np.asarray(decoded.convert('RGB'), dtype=np.float64)))
+            ssims.append(ssim(luma(tile), luma(decoded)))
+
+    # Identical tiles have infinite PSNR, leave them out of the average rather than swamping it
+    finite = [p for p in psnrs if math.isfinite(p)]
+    return {
+        'format': format,
+        'quality': quality,
+        'tiles': len(tiles),
+        'bytes': size,
+        'bytes_per_tile': size / len(tiles),
+        'encode_ms_per_tile': encode_time * 1000 / len(tiles),
+        'psnr': sum(finite) / len(finite) if finite else math.inf,
+        'ssim': sum(ssims) / len(ssims),
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Compare tile size, encode time and quality of the tile formats')
+    parser.add_argument('tiles', type=Path, nargs='+', help='tile images or directories of tiles to sample')
+    parser.add_argument('-f', '--formats', nargs='+', help='formats to compare (default all available)')
+    parser.add_argument(
+        '-Q', '--qualities', type=int, nargs='+', default=[default_quality], help='quality settings to try'
+    )
+    parser.add_argument('-n', '--count', type=int, default=200, help='number of tiles to sample (default 200)')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed for picking the sample')
+    parser.add_argument('-o', '--output', type=Path, help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    formats = args.formats or [f for f in available_formats() if f != 'jpeg']
+    unavailable = set(formats) - set(available_formats())
+    if unavailable:
+        parser.error('unsupported formats: ' + ', '.join(sorted(unavailable)))
+
+    tiles = load_sample(args.tiles, args.count, args.seed)
+    if not tiles:
+        parser.error('no tiles found')
+    print(f'{len(tiles)} tiles sampled', file=sys.stderr)
+
+    results = []
+    print(f"{'format':<6} {'quality':>7} {'bytes/tile':>10} {'ms/tile':>8} {'psnr':>7} {'ssim':>7}")
+    for format in formats:
+        # png is lossless so quality makes no difference
+        for quality in args.qualities if format != 'png' else args.qualities[:1]:
+            result = benchmark(tiles, format, quality)
+            results.append(result)
+            print(
+                f"{format:<6} {quality:>7} {result['bytes_per_tile']:>10.0f} {result['encode_ms_per_tile']:>8.2f}"
+                f" {result['psnr']:>7.2f} {result['ssim']:>7.4f}"
+            )
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark reading and writing JSON through parserlib.fileio with and without the fast backend
+
+Times loads_json/dumps_json (the work done by load_json_file/save_json_file) using the json module
+and using orjson (if installed) on each file and checks they decode to the same data and write
+byte for byte the same text, eg:
+    uv run benchjson.py ..\\source\\sw\\levels\\*.json
+With no files a synthetic level of UE style objects is used, along with the web map data files.
+"""
+
+import json
+import random
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Callable
+
+from parserlib import fileio
+from parserlib.fileio import dumps_json, loads_json
+
+
+def synthetic_level(count: int, seed: int = 1) -> list[dict[str, Any]]:
+    """
+    a level file like those CUE4Parse exports: actors and components with transforms and references
+    """
+    rng = random.Random(seed)
+    level = []
+    for i in range(count):
+        otype = rng.choice(['Coin_C', 'Chest_C', 'StaticMeshComponent', 'SceneComponent', 'Jumppad_C'])
+        level.append(
+            {
+                'Type': otype,
+                'Name': f'{otype}_{i}',
+                'Outer': 'PersistentLevel',
+                'Class': f"UScriptClass'{otype}'",
+                'Flags': 'RF_Transactional',
+                'Properties': {
+                    'RelativeLocation': {axis: rng.uniform(-50000, 50000) for axis in 'XYZ'},
+                    'RelativeRotation': {'Pitch': 0.0, 'Yaw': rng.uniform(-180, 180), 'Roll': rng.uniform(-1e-5, 1e-5)},
+                    'RelativeScale3D': {'X': 1.0, 'Y': 1.0, 'Z': rng.choice([1.0, 2.5])},
+                    'AttachParent': {
+                        'ObjectName': f"SceneComponent'Map:PersistentLevel.{otype}_{i}.DefaultSceneRoot'",
+                        'ObjectPath': f'Supraworld/Content/Maps/Map.{rng.randint(0, count)}',
+                    },
+                    'bHidden': rng.random() < 0.1,
+                    'Coins': rng.randint(1, 100),
+                },
+            }
+        )
+    return level
+
+
+def best_time(func: Callable[[], Any], repeat: int) -> tuple[float, Any]:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark(name: str, raw: bytes, repeat: int) -> bool:
+    load_std, data_std = best_time(lambda: loads_json(raw, fast=False), repeat)
+    load_fast, data_fast = best_time(lambda: loads_json(raw), repeat)
+    save_std, text_std = best_time(lambda: dumps_json(data_std, fast=False), repeat)
+    save_fast, text_fast = best_time(lambda: dumps_json(data_std), repeat)
+    same = data_std == data_fast and text_std == text_fast
+    print(
+        f'{name:<32} {len(raw) / 1e6:>7.1f} {load_std * 1000:>9.1f} {load_fast * 1000:>9.1f} {load_std / load_fast:>5.1f}x'
+        f' {save_std * 1000:>9.1f} {save_fast * 1000:>9.1f} {save_std / save_fast:>5.1f}x  {"same" if same else "DIFFERENT"}'
+    )
+    return same
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Compare JSON load/save times of the json module and the fast backend')
+    parser.add_argument('files', type=Path, nargs='*', help='JSON files to time (default synthetic level and web data)')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='runs of each, the best is reported (default 3)')
+    parser.add_argument('--objects', type=int, default=100000, help='objects in the synthetic level (default 100000)')
+    args = parser.parse_args()
+
+    if not fileio.orjson:
+        sys.exit('orjson is not installed (pip install orjson) so there is no fast backend to compare')
+
+    files = args.files or sorted(Path(__file__).parent.joinpath('..', 'public', 'data').glob('markers.*.json'))
+    samples = [(path.name, path.read_bytes()) for path in files]
+    if not args.files:
+        samples.insert(0, ('synthetic level', json.dumps(synthetic_level(args.objects), indent=2).encode()))
+
+    print(f"{'file':<32} {'MB':>7} {'load ms':>9} {'fast ms':>9} {'':>6} {'save ms':>9} {'fast ms':>9}")
+    if not all([benchmark(name, raw, args.repeat) for name, raw in samples]):
+        sys.exit('fast backend output differs from the json module')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark how long each supraland_parser.py command takes to start
+
+Runs each command (and --help) against an empty source and data directory, where each stops at the
+first file it can't find, so the time is that of starting Python, importing what the command needs
+and parsing the arguments. The slowest top level imports of each are listed (from python -X
+importtime), eg:
+    uv run benchstartup.py
+Quick commands (--help, --loc, --version) should start in well under a second, only the marker
+exports need numpy, scipy and scikit-learn.
+"""
+
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+parser_script = Path(__file__).parent.joinpath('supraland_parser.py')
+
+modes = [
+    ('help', ['--help']),
+    ('loc', ['-g', 'sl', '--loc']),
+    ('version', ['-g', 'sw', '--version']),
+    ('preproc', ['-g', 'sw', '--preproc']),
+    ('markers sl', ['-g', 'sl', '--markers', '--jobs', '1']),
+    ('markers sw', ['-g', 'sw', '--markers']),
+]
+
+
+def run(args: list[str], importtime: bool = False) -> tuple[float, str]:
+    """
+    runs the parser with the arguments, returning the wall time and what it wrote to stderr
+    """
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [str(parser_script)] + args
+    start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True, cwd=parser_script.parent)
+    return time.perf_counter() - start, result.stderr
+
+
+def slowest_imports(importtime: str, count: int) -> list[tuple[str, float]]:
+    """
+    the top level imports taking longest (cumulative, in seconds) from python -X importtime output
+    """
+    imports = []
+    for line in importtime.splitlines():
+        if line.startswith('import time:') and not line.endswith('imported package'):
+            _, cumulative, name = line[len('import time:') :].split('|')
+            if cumulative.strip().isdigit() and not name.startswith('  '):
+                imports.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda i: -i[1])[:count]
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Time the start up of each supraland_parser.py command')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='runs of each, the best is reported (default 3)')
+    parser.add_argument('-i', '--imports', type=int, default=3, help='slowest top level imports listed (default 3)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp:
+        source, data = Path(temp, 'source'), Path(temp, 'data')
+        source.mkdir()
+        data.mkdir()
+        print(f"{'command':<12} {'best ms':>9}  slowest imports (ms)")
+        for name, mode_args in modes:
+            mode_args = mode_args + ['--source', str(source), '--data', str(data)]
+            best = min(run(mode_args)[0] for _ in range(args.repeat))
+            imports = slowest_imports(run(mode_args, importtime=True)[1], args.imports)
+            print(f'{name:<12} {best * 1000:>9.0f}  ' + ', '.join(f'{i} {t * 1000:.0f}' for i, t in imports))
+
+
+if __name__ == '__main__':
+    main()
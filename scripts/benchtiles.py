@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmark for gentiles.py
+
+Builds a synthetic map image (the same pixels every time for a given size and seed) then
+times gentiles over it with each configuration, collecting the --stats output of every run:
+    uv run benchtiles.py -o bench.json
+    uv run benchtiles.py --size 16384 -c "-t jpg -w 512 -j 8" -c "-t jpg -w 512 -j 8 -p"
+
+Every run writes all the tiles (--force) into a fresh output directory. Compare the JSON from
+before and after a change to the tiler, on the same machine.
+"""
+
+import json
+import shlex
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Settings used by export.cmd, serial and in parallel, with and without the pyramid
+default_configs = [
+    '-t jpg -w 512',
+    '-t jpg -w 512 -j 4',
+    '-t jpg -w 512 -j 4 -p',
+    '-t jpg -w 512 -j 4 -p -d',
+]
+
+
+def synthetic_rows(width: int, top: int, bottom: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    rows top to bottom of the synthetic map: smooth 'terrain' colours with noisy detail, on
+    a solid background outside a central disc (like the sea around the islands of the maps)
+    """
+    y, x = np.mgrid[top:bottom, 0:width].astype(np.float32) / width
+    terrain = np.stack(
+        [
+            96 + 64 * np.sin(x * 23.0) * np.cos(y * 17.0),
+            128 + 48 * np.sin((x + y) * 31.0),
+            80 + 40 * np.cos(x * 11.0 - y * 29.0),
+        ],
+        axis=-1,
+    )
+    terrain += rng.normal(0, 12, terrain.shape).astype(np.float32)
+    land = (x - 0.5) ** 2 + (y - 0.5) ** 2 < 0.16
+    pixels = np.where(land[..., np.newaxis], terrain, np.array([24, 48, 96], dtype=np.float32))
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def make_source(path: Path, size: int, seed: int, strip_height: int = 512) -> None:
+    """
+    writes the synthetic map as a binary PPM a strip at a time, then converts it if path isn't a .ppm
+    """
+    rng = np.random.default_rng(seed)
+    ppm_path = path.with_suffix('.ppm')
+    with ppm_path.open('wb') as file:
+        file.write(f'P6\n{size} {size}\n255\n'.encode())
+        for top in range(0, size, strip_height):
+            synthetic_rows(size, top, min(top + strip_height, size), rng).tofile(file)
+    if path != ppm_path:
+        with Image.open(ppm_path) as image:
+            image.save(path)
+        ppm_path.unlink()
+
+
+def run(source: Path, config: str, zoom_levels: str, workdir: Path, index: int) -> dict:
+    output = workdir.joinpath(f'tiles{index}')
+    stats_path = workdir.joinpath(f'stats{index}.json')
+    gentiles = Path(__file__).with_name('gentiles.py')
+    args = [sys.executable, str(gentiles), '-q', '-f', '-s', str(stats_path)] + shlex.split(config)
+    subprocess.run(args + [str(source), zoom_levels, str(output)], check=True, stdout=subprocess.DEVNULL)
+    return {'config': config} | json.loads(stats_path.read_text())
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Benchmark gentiles.py on a synthetic map image')
+    parser.add_argument('--size', type=int, default=8192, help='width and height of the image (default 8192)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the image noise (default 1)')
+    parser.add_argument('--source', choices=['png', 'ppm'], default='png', help='source image format (default png)')
+    parser.add_argument('-z', '--zoom', default='0-4', help='zoom levels to generate (default 0-4)')
+    parser.add_argument(
+        '-c', '--config', action='append', help='gentiles options for a run, may be repeated (default a set of runs)'
+    )
+    parser.add_argument('-n', '--repeat', type=int, default=1, help='times to run each configuration')
+    parser.add_argument('-o', '--output', type=Path, help='write all the run stats to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='benchtiles') as temp:
+        workdir = Path(temp)
+        source = workdir.joinpath(f'synthetic.{args.source}')
+        print(f'Creating {args.size}x{args.size} synthetic {args.source}', file=sys.stderr)
+        make_source(source, args.size, args.seed)
+
+        runs = []
+        print(f"{'config':<32} {'seconds':>8} {'tiles/s':>8} {'rss MB':>7}  slowest stages")
+        for config in args.config or default_configs:
+            for _ in range(args.repeat):
+                result = run(source, config, args.zoom, workdir, len(runs))
+                runs.append(result)
+                total = result['total']
+                rss = max(result['peak_rss'].values()) / (1 << 20)
+                stages = sorted(total['stages'].items(), key=lambda item: -item[1])[:3]
+                slowest = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in stages)
+                print(f"{config:<32} {total['seconds']:>8.2f} {total['tiles_per_second']:>8.1f} {rss:>7.0f}  {slowest}")
+
+    if args.output:
+        benchmark = {'size': args.size, 'seed': args.seed, 'source': args.source, 'zoom': args.zoom, 'runs': runs}
+        args.output.write_text(json.dumps(benchmark, indent=2))
+
+
+if __name__ == '__main__':
+    main()
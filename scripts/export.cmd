@@ -147,6 +147,8 @@ exit /b
 :: export sw applyfog           - to appply swmapfog to swmap and create swmap-fogged.png
 :: {manually produce ..\source\{game}map-final.png}
 :: export all gentiles          - to generate tiles for runtime map
+::                                (extra arguments are passed to gentiles.py, eg to apply the fog
+::                                while tiling rather than with applyfog: -m ..\source\sw\mapimg\swmapfog-ea.png)
 
 :: Todo: Add export markers, extract loc keys from blueprints, generate loc files
 
@@ -175,6 +177,7 @@ echo  mapimg   extracts .png map image files and merges them together
 echo  getfog   extract editable for fog map from [{savename}]
 echo  applyfog combine swmapfog.png and swmap.png into swmap-fogged.png
 echo  gentiles takes ..\source\{game}map-final.png and generates tiles in ..\tiles\{game}\base
+echo           extra arguments are passed to gentiles.py (ie -m {fogfile} to apply fog while tiling)
 echo.
 echo Data parsing:
 echo  version  update version numbers (versions.json)
@@ -397,12 +400,14 @@ goto :eof
 
 set tiledir=..\public\tiles\%game%\base
 set mappng=..\source\%game%map-final.png
+:: The hashes gentiles keeps to only rewrite changed tiles are kept with the source, out of public
+set manifest=..\source\%game%map-tiles.manifest.json
 
 echo %colGrn%Generating map tiles in %tiledir% from %mappng%%colDef%
 
 if not exist "%tiledir%" md "%tiledir%""
 
-uv run gentiles.py -t jpg -w 512 %mappng% 0-4 %tiledir%
+uv run gentiles.py -t jpg -w 512 -j %NUMBER_OF_PROCESSORS% -M %manifest% %extraargs% %mappng% 0-4 %tiledir%
 
 goto :eof
 
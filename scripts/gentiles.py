@@ -10,15 +10,40 @@ at the appropriate size and file structure for use
 in frameworks like leaflet.js, MapBox, etc.
 
 ARGS:
-input_file      large image file to split (JPG, PNG, or TIFF)
+input_file      large image file to split (JPG, PNG, TIFF, or binary
+            PPM/PGM which is read a strip of rows at a time)
 zoom_level              zoom level(s) to generate (0 to 18); either
             integer or range (ex: 2-6)
 output_folder           folder name to write tiles to (will be created
-            if does not exist)
+            if does not exist), or a .mbtiles file to write them
+            to a single archive
 
 OPTIONAL:
 -h, --help              show this help message and exit
 -w --resize_width   dimension in pixels for outputted tiles (default 256px)
+-t, --format            output format (png, jpeg, webp or avif, the last two
+            if Pillow was built with them)
+-Q, --quality           quality for lossy formats (default 85), see
+            benchencoders.py for comparing formats and settings
+-j, --jobs              number of worker processes generating tiles (default 1),
+            the decoded source image is shared between them
+-p, --pyramid           only generate the deepest zoom level from the source
+            image, each shallower level is built by joining 2x2
+            blocks of tiles from the level below and halving them
+-f, --force             write every tile, even those whose source is unchanged
+            since the last run (see UPDATING TILES)
+-M, --manifest          where to keep the hashes of the tiles' sources (default
+            output_folder.manifest.json next to output_folder)
+-m, --fog               fog of war mask (eg swmapfog-ea.png) to multiply into
+            the tiles, stretched over the whole image if the sizes
+            differ (only its first channel is used)
+-r, --retina            also write @2x tiles of twice the width (y@2x.png)
+            for high DPI displays, from the same source crops
+-s, --stats             write a JSON file of the time spent on each zoom level
+            and stage (crop, resize, encode, write...), tiles per
+            second and peak memory use (see benchtiles.py)
+-d, --dedup             store each distinct tile once, tiles with the same
+            pixels (eg solid background) are hard links to it
 -q, --quiet             suppress all output from program (useful for
             integrating into larger projects)
 
@@ -48,10 +73,32 @@ you specify others), and should be noted in your Javascript.
 For example, if using leaflet.js, you would use:
     tiles/{z}/{x}/{y}.png
 
+With --retina the @2x tiles sit next to the others, which
+leaflet picks up with the {r} placeholder on high DPI
+displays (and detectRetina set):
+    tiles/{z}/{x}/{y}{r}.png
+
+TILE ARCHIVES
+Giving an output_folder ending in .mbtiles writes all the
+tiles to one MBTiles (SQLite) file instead, with identical
+tiles stored once and the manifest in a .manifest.json
+file next to it. Unpack it to the directory structure
+with unpacktiles.py.
+
 ADDING MORE ZOOM LEVELS
 Want to add more levels? Just run this script again; it
 will append the new zoom level to the same location.
 
+UPDATING TILES
+A hash of the source pixels for each tile is kept in
+output_folder.manifest.json next to the output folder
+(or the file given with --manifest), not in it, so it
+isn't published with the tiles. Running the script again
+only writes the tiles whose source has changed, the
+files for the others are left untouched. A manifest.json
+left in the output folder by an older version is moved
+out to the new place.
+
 CREATING A SOURCE IMAGE
 If combining many smaller images, the easiest method
 is to use ImageMagick's 'montage' command.
@@ -79,20 +126,46 @@ VERY LARGE IMAGES:
 When working with extra big images, ImageMagick makes
 some suggestions where RAM may run out:
 http://www.imagemagick.org/Usage/files/#massive
+
+Images in other formats have to be decoded into memory in
+one go. Converting the source to a binary PPM (or PGM)
+first means only the strip of rows for the current row of
+tiles is read and held in memory:
+    magick swmap-final.png swmap-final.ppm
+
+Use --pyramid as well so the shallow zoom levels (where a
+tile covers a large part of the image) are built from the
+deepest level rather than read from the source.
 """
 
+import json
 import logging
 import math
 import re
+import shutil
 import sys
 from argparse import ArgumentError, ArgumentParser
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import Any, Optional
+from time import perf_counter
+from typing import Any, Iterable, Optional
 
 from PIL import Image, UnidentifiedImageError
 
+from tilelib.encoders import available_formats, default_quality, encode_tile
+from tilelib.fog import load_fog
+from tilelib.manifest import TileManifest, hash_image, hash_tiles, pixels_key
+from tilelib.sources import RawImage, SharedImage, attach_image, raw_suffixes, shareable_modes
+from tilelib.timing import TileStats, Timings
+from tilelib.writers import TileWriter
+
 LOG = logging.getLogger(__name__)
 
+# Strips of more rows than this are worth a warning when reading windowed sources
+big_strip_height = 4096
+
 
 def power_of(num: int, base: int) -> bool:
     """checks if a number is a power another"""
@@ -101,12 +174,268 @@ def power_of(num: int, base: int) -> bool:
     return num == 1
 
 
-def generate(image: Image, outpath: Path, zoom_level: int, resize_width: int, format: str = 'png') -> None:
+# Suffix of the @2x tiles for high DPI displays (leaflet's {r} in the tile url)
+retina_suffix = '@2x'
+
+
+@dataclass(frozen=True)
+class TileOptions:
+    """
+    options for producing tiles, passed to the worker processes
+    """
+
+    resize_width: int = 256
+    format: str = 'png'
+    quality: int = default_quality
+    fog: Optional[Path] = None  # fog of war mask to multiply into the tiles
+    salt: bytes = b''  # salt for the source hashes (from the TileManifest)
+    dedup: bool = False  # find the pixels key of each tile so duplicates can be stored once
+    retina: bool = False  # also produce @2x tiles of twice the width
+
+    @property
+    def variants(self) -> list[tuple[str, int]]:
+        """
+        file name suffix and width of each variant of a tile that is produced
+        """
+        return [('', self.resize_width)] + ([(retina_suffix, self.resize_width * 2)] if self.retina else [])
+
+
+# Tile produced by a worker: x, y, hash of its source and the suffix, pixels key (if dedup is set)
+# and encoded data of each variant (an empty list if unchanged since the previous run)
+TileResult = tuple[int, int, str, list[tuple[str, Optional[str], bytes]]]
+
+# Kept tiles are a tuple of the variants of each tile
+TileImages = tuple[Image, ...]
+
+# What a worker returns for a row or column: the tiles, the kept tiles (if keep_tiles is set) and
+# how long it spent on each stage
+WorkResult = tuple[list[TileResult], Optional[list[TileImages]], Timings]
+
+# Encoded solid colour tiles by pixels key, as the same few turn up all over the map background
+solid_tiles: dict[str, bytes] = {}
+
+
+def finish_tile(
+    tiles: TileImages, x: int, y: int, tile_hash: str, unchanged: bool, options: TileOptions, timings: Timings
+) -> TileResult:
+    """
+    encodes each variant of a tile unless it is unchanged since the previous run
+    """
+    if unchanged:
+        return (x, y, tile_hash, [])
+
+    variants = []
+    for (suffix, _), tile in zip(options.variants, tiles):
+        if not options.dedup:
+            with timings.stage('encode'):
+                variants.append((suffix, None, encode_tile(tile, options.format, options.quality)))
+            continue
+        with timings.stage('dedup'):
+            key = pixels_key(tile)
+        with timings.stage('encode'):
+            data = solid_tiles.get(key) or encode_tile(tile, options.format, options.quality)
+        if key.startswith('solid:'):
+            solid_tiles[key] = data
+        variants.append((suffix, key, data))
+    return (x, y, tile_hash, variants)
+
+
+def generate_row(
+    image: Image,
+    y: int,
+    num_tiles: int,
+    tile_width: int,
+    options: TileOptions,
+    keep_tiles: bool = False,
+    previous: Optional[list[Optional[str]]] = None,
+) -> WorkResult:
+    """
+    generates the tiles for row y of a zoom level, returning them encoded along with the hashes
+    of their source regions (and the tiles themselves if keep_tiles is set)
+
+    Tiles whose source hash matches the one in previous (indexed by x) are not encoded again
+    """
+    top = tile_width * y
+    bottom = top + tile_width
+    fog = load_fog(options.fog, image.size) if options.fog else None
+    source_top = top
+    timings = Timings()
+
+    # For windowed sources read just the strip of rows covered by this row of tiles
+    if isinstance(image, RawImage):
+        with timings.stage('read'):
+            image = image.crop([0, top, tile_width * num_tiles, bottom])
+        top, bottom = 0, tile_width
+
+    results = []
+    tiles = []
+    for x in range(num_tiles):
+        left = tile_width * x
+        right = left + tile_width
+        with timings.stage('crop'):
+            region = image.crop([left, top, right, bottom])
+        if fog:
+            with timings.stage('fog'):
+                region = fog.apply(region, (left, source_top, right, source_top + tile_width))
+        with timings.stage('hash'):
+            tile_hash = hash_image(options.salt, region)
+        unchanged = previous is not None and tile_hash == previous[x]
+        if unchanged and not keep_tiles:
+            results.append((x, y, tile_hash, []))
+            continue
+        # Each variant is resized from the same crop so we only read the source once for all of them
+        with timings.stage('resize'):
+            variants = tuple(region.resize([width, width]) for _, width in options.variants)
+        results.append(finish_tile(variants, x, y, tile_hash, unchanged, options, timings))
+        if keep_tiles:
+            tiles.append(variants)
+    return results, tiles if keep_tiles else None, timings.finish()
+
+
+def merge_block(block_tiles: list[Image], size: int) -> Image:
+    """
+    joins a 2x2 block of tiles (top left, top right, bottom left, bottom right) and halves it
+    """
+    block = Image.new(block_tiles[0].mode, (size * 2, size * 2))
+    for i, tile in enumerate(block_tiles):
+        block.paste(tile, ((i % 2) * size, (i // 2) * size))
+    return block.resize([size, size])
+
+
+def merge_column(
+    children: list[list[TileImages]],
+    child_hashes: list[list[str]],
+    x: int,
+    options: TileOptions,
+    keep_tiles: bool = False,
+    previous: Optional[list[Optional[str]]] = None,
+) -> WorkResult:
+    """
+    generates the tiles for column x of a zoom level from the two columns (2x, 2x + 1) of the
+    level below, by joining each 2x2 block of tiles and halving it
+
+    Returns the tiles encoded along with their hashes (made from the hashes of the tiles they were
+    built from) and the tiles themselves if keep_tiles is set. Tiles whose hash matches previous
+    aren't encoded again.
+    """
+    left, right = children
+    left_hashes, right_hashes = child_hashes
+    timings = Timings()
+    results = []
+    tiles = []
+    for y in range(len(left) // 2):
+        block_hashes = [left_hashes[2 * y], right_hashes[2 * y], left_hashes[2 * y + 1], right_hashes[2 * y + 1]]
+        tile_hash = hash_tiles(options.salt, block_hashes)
+        unchanged = previous is not None and tile_hash == previous[y]
+        if unchanged and not keep_tiles:
+            results.append((x, y, tile_hash, []))
+            continue
+        with timings.stage('resize'):
+            variants = tuple(
+                merge_block([left[2 * y][i], right[2 * y][i], left[2 * y + 1][i], right[2 * y + 1][i]], size)
+                for i, (_, size) in enumerate(options.variants)
+            )
+        results.append(finish_tile(variants, x, y, tile_hash, unchanged, options, timings))
+        if keep_tiles:
+            tiles.append(variants)
+    return results, tiles if keep_tiles else None, timings.finish()
+
+
+# Source image attached by each worker process (see init_worker)
+worker_image: Optional[SharedImage | RawImage] = None
+
+
+def init_worker(spec: tuple) -> None:
+    """
+    attaches a tile worker process to the shared (or windowed) source image
+    """
+    global worker_image
+    worker_image = attach_image(spec)
+
+
+def worker_generate_row(args: tuple[int, Optional[list[str]]], **kwargs: Any) -> WorkResult:
+    y, previous = args
+    return generate_row(image=worker_image, y=y, previous=previous, **kwargs)
+
+
+def worker_merge_column(args: tuple, **kwargs: Any) -> WorkResult:
+    x, children, child_hashes, previous = args
+    return merge_column(children=children, child_hashes=child_hashes, x=x, previous=previous, **kwargs)
+
+
+def write_tiles(
+    results: Iterable[WorkResult],
+    writer: TileWriter,
+    manifest: TileManifest,
+    zoom_level: int,
+    timings: Timings,
+) -> list[Optional[list[TileImages]]]:
+    """
+    writes the tiles from each worker result as they arrive and records their hashes in the manifest,
+    returning the kept tiles of each result. The workers' timings are added to timings.
+
+    Prints a '.' for each tile written and a '-' for each tile left as it was
+    """
+    kept = []
+    for tile_results, tiles, worker_timings in results:
+        for x, y, tile_hash, variants in tile_results:
+            with timings.stage('write'):
+                for suffix, key, data in variants:
+                    writer.write(zoom_level, x, y, data, key, suffix)
+            timings.count('tiles')
+            timings.count('written' if variants else 'unchanged')
+            print('.' if variants else '-', end='')
+            manifest.set(zoom_level, x, y, tile_hash)
+        sys.stdout.flush()
+        timings.merge(worker_timings)
+        kept.append(tiles)
+    print('')
+    return kept
+
+
+def previous_hashes(writer: TileWriter, manifest: TileManifest, z: int, tiles: Iterable[tuple[int, int]]) -> list:
+    """
+    hashes recorded by the previous run for the given tiles, None for any tile that has since gone missing
+    """
+    return [manifest.get_previous(z, x, y) if writer.exists(z, x, y) else None for x, y in tiles]
+
+
+def log_level_timings(zoom_level: int, seconds: float, timings: Timings, stats: Optional[TileStats]) -> None:
+    """
+    logs how quickly the tiles of a level were produced, and records it in stats if given
+    """
+    tiles = timings.counts.get('tiles', 0)
+    LOG.info('%d tiles in %.2fs (%.1f tiles/s)', tiles, seconds, tiles / seconds if seconds else 0)
+    if stats:
+        stats.add_level(zoom_level, seconds, timings)
+
+
+def generate(
+    image: Image,
+    writer: TileWriter,
+    manifest: TileManifest,
+    zoom_level: int,
+    options: TileOptions,
+    pool: Optional[Executor] = None,
+    keep_tiles: bool = False,
+    stats: Optional[TileStats] = None,
+) -> Optional[list[list[TileImages]]]:
     """
     generates map tiles from large image
+
+    If a pool is given the rows of tiles are farmed out to its workers which must have
+    been initialised with init_worker (the image argument is then only used for its size)
+
+    If keep_tiles is set the tiles are returned as a list of columns for generate_from_tiles
+
+    If stats are given the time spent on the level is added to them
+
+    Tiles whose source region hasn't changed since the previous run recorded in the
+    manifest are left alone and the manifest is updated with the new hashes
     """
 
     # how many tiles will that be?
+    start = perf_counter()
     num_tiles = 1 << zoom_level
     LOG.info('Zoom level ' + str(zoom_level) + ' = ' + str(num_tiles) + ' tiles')
 
@@ -121,33 +450,77 @@ def generate(image: Image, outpath: Path, zoom_level: int, resize_width: int, fo
     tile_width = int(math.ceil(width / num_tiles))
     LOG.info('' + str(tile_width) + ' x ' + str(tile_width) + ' px tiles')
 
-    # create output directory
-    outpath = outpath.joinpath(str(zoom_level))
-    outpath.mkdir(exist_ok=True, parents=True)
+    if isinstance(image, RawImage) and tile_width > big_strip_height:
+        LOG.warning('Reading %d rows at a time from the source image, use --pyramid to avoid this', tile_width)
 
-    # Remove existing children
-    for child in outpath.rglob('*.' + format):
-        child.unlink()
+    writer.prepare_level(zoom_level)
 
-    for x in range(num_tiles):
-        outpath.joinpath(str(x)).mkdir(exist_ok=True, parents=True)
-        for y in range(num_tiles):
-            left = tile_width * x
-            top = tile_width * y
-            right = left + tile_width
-            bottom = top + tile_width
-            tile = image.crop([left, top, right, bottom])
-            tile = tile.resize([resize_width, resize_width])
-            tile_path = outpath.joinpath(f'{x}/{y}.' + format)
-            tile.save(tile_path, quality=85)
-            # tile.save(tile_path)
-            print('.', end='')
-            sys.stdout.flush()
-            # Note on quality: We were using about 75 but it comes out with lots of JPG compression artefacts
-            # 95 is pretty much perfect. 85 is a fair compromise
-    print('')
+    row_args = dict(num_tiles=num_tiles, tile_width=tile_width, options=options, keep_tiles=keep_tiles)
+    rows = [
+        (y, previous_hashes(writer, manifest, zoom_level, ((x, y) for x in range(num_tiles)))) for y in range(num_tiles)
+    ]
+    if pool:
+        # Rows are independent so workers can render them in any order, the tiles are identical
+        results = pool.map(partial(worker_generate_row, **row_args), rows)
+    else:
+        results = (generate_row(image=image, y=y, previous=previous, **row_args) for y, previous in rows)
+    timings = Timings()
+    kept = write_tiles(results, writer, manifest, zoom_level, timings)
+    log_level_timings(zoom_level, perf_counter() - start, timings, stats)
+
+    LOG.info('- done!')
+    return [list(column) for column in zip(*kept)] if keep_tiles else None
+
+
+def generate_from_tiles(
+    tiles: list[list[TileImages]],
+    writer: TileWriter,
+    manifest: TileManifest,
+    zoom_level: int,
+    options: TileOptions,
+    pool: Optional[Executor] = None,
+    keep_tiles: bool = False,
+    stats: Optional[TileStats] = None,
+) -> Optional[list[list[TileImages]]]:
+    """
+    generates map tiles for a zoom level from the tiles of the level below (zoom_level + 1)
+
+    This is the pyramid approach, each level is a quarter of the work of the one below rather
+    than resampling the whole source image again
+
+    The manifest must hold the hashes of the level below from this run, tiles made from
+    the same tiles as the previous run are left alone
+    """
+    start = perf_counter()
+    num_tiles = 1 << zoom_level
+    LOG.info('Zoom level ' + str(zoom_level) + ' = ' + str(num_tiles) + ' tiles (from level below)')
+
+    writer.prepare_level(zoom_level)
+
+    column_args = dict(options=options, keep_tiles=keep_tiles)
+
+    def child_hashes(x: int) -> list[Optional[str]]:
+        return [manifest.get(zoom_level + 1, x, y) for y in range(2 * num_tiles)]
+
+    columns = [
+        (
+            x,
+            tiles[2 * x : 2 * x + 2],
+            [child_hashes(2 * x), child_hashes(2 * x + 1)],
+            previous_hashes(writer, manifest, zoom_level, ((x, y) for y in range(num_tiles))),
+        )
+        for x in range(num_tiles)
+    ]
+    if pool:
+        results = pool.map(partial(worker_merge_column, **column_args), columns)
+    else:
+        results = (worker_merge_column(column, **column_args) for column in columns)
+    timings = Timings()
+    kept = write_tiles(results, writer, manifest, zoom_level, timings)
+    log_level_timings(zoom_level, perf_counter() - start, timings, stats)
 
     LOG.info('- done!')
+    return kept if keep_tiles else None
 
 
 def zoom_range_type(value: Any) -> tuple[int, int]:
@@ -184,14 +557,18 @@ def positive_int_type(rawvalue: Any) -> int:
 
 def create_parser() -> ArgumentParser:
     parser = ArgumentParser(description="Generate map files for leaflet")
-    parser.add_argument('input_file', type=Path, help='large image file to split (JPG, PNG, or TIFF)')
+    parser.add_argument(
+        'input_file', type=Path, help='large image file to split (JPG, PNG, TIFF, or PPM/PGM read in strips)'
+    )
     parser.add_argument(
         'zoom_level',
         type=zoom_range_type,
         help='zoom level(s) to generate (0 to 18); either integer or range (ex: 2-6)',
     )
     parser.add_argument(
-        'output_folder', type=Path, help='folder name to write tiles to (will be created if does not exist)'
+        'output_folder',
+        type=Path,
+        help='folder name to write tiles to (will be created if does not exist) or a .mbtiles archive',
     )
     parser.add_argument(
         '-w',
@@ -208,16 +585,96 @@ def create_parser() -> ArgumentParser:
         default=False,
         help='suppress all output from program (useful for integrating into larger projects)',
     )
-    parser.add_argument('-t', '--format', default='png', help='output format (png or jpeg)')
+    parser.add_argument('-t', '--format', default='png', help='output format (png, jpeg, webp or avif)')
+    parser.add_argument(
+        '-Q',
+        '--quality',
+        metavar='',
+        type=positive_int_type,
+        default=default_quality,
+        help=f'quality for lossy formats (default {default_quality})',
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        metavar='',
+        type=positive_int_type,
+        default=1,
+        help='number of worker processes generating tiles (default 1)',
+    )
+    parser.add_argument(
+        '-p',
+        '--pyramid',
+        action='store_true',
+        default=False,
+        help='only generate the deepest zoom level from the image, build the others from the level below',
+    )
+    parser.add_argument(
+        '-f',
+        '--force',
+        action='store_true',
+        default=False,
+        help='write every tile, even those whose source is unchanged since the last run',
+    )
+    parser.add_argument(
+        '-M',
+        '--manifest',
+        metavar='',
+        type=Path,
+        help='file to keep the hashes of the tile sources in (default output_folder.manifest.json)',
+    )
+    parser.add_argument(
+        '-m',
+        '--fog',
+        metavar='',
+        type=Path,
+        help='fog of war mask image to multiply into the tiles (eg swmapfog-ea.png)',
+    )
+    parser.add_argument(
+        '-r',
+        '--retina',
+        action='store_true',
+        default=False,
+        help='also generate tiles of twice the width (y@2x.png) for high DPI displays from the same pass',
+    )
+    parser.add_argument(
+        '-s',
+        '--stats',
+        metavar='',
+        type=Path,
+        help='write timings for each zoom level and stage (crop, resize, encode, write...) to this JSON file',
+    )
+    parser.add_argument(
+        '-d',
+        '--dedup',
+        action='store_true',
+        default=False,
+        help='store tiles with identical pixels (eg solid background) once, duplicates are hard links to it',
+    )
     return parser
 
 
+def move_old_manifest(output_path: Path, manifest_path: Path) -> None:
+    """
+    moves a manifest.json kept in the tile directory (by older versions) to where it is kept now, out
+    of the tiles so it isn't published with them
+    """
+    old_path = output_path.joinpath('manifest.json')
+    if output_path.is_dir() and old_path.is_file():
+        if manifest_path.exists():
+            old_path.unlink()
+        else:
+            manifest_path.parent.mkdir(exist_ok=True, parents=True)
+            shutil.move(old_path, manifest_path)
+        LOG.info('Moved the tile manifest out of the tiles to %s', manifest_path)
+
+
 def setup_logging(quiet: bool = False) -> None:
     logging.basicConfig(format='%(levelname)s: %(message)s', stream=sys.stderr)
     LOG.setLevel(logging.WARNING if quiet else logging.INFO)
 
 
-def main() -> None:
+def main() -> None:  # noqa: C901 - disable complexity warning
     parser = create_parser()
     args = parser.parse_args()
 
@@ -225,29 +682,111 @@ def main() -> None:
     zoom_min, zoom_max = args.zoom_level
     output_path = args.output_folder
     setup_logging(quiet=args.quiet)
+    stats = TileStats(
+        input_file=str(input_path),
+        zoom_levels=[zoom_min, zoom_max],
+        **{k: getattr(args, k) for k in ('resize_width', 'format', 'quality', 'jobs', 'pyramid', 'retina', 'dedup')},
+    )
+
+    if args.format not in available_formats():
+        LOG.error("Unsupported tile format %s, expected one of %s", args.format, ', '.join(available_formats()))
+        sys.exit(1)
 
-    # open the image
+    # open the image (netpbm images are read a strip at a time rather than decoded in one go)
     try:
-        image = Image.open(str(input_path))
+        if input_path.suffix.lower() in raw_suffixes:
+            image = RawImage.open(input_path)
+        else:
+            image = Image.open(str(input_path))
         width, height = image.size
+        stats.info['source_size'] = [width, height]
         if not power_of(num=width, base=2):
             LOG.warning('Source image dims should be power of 2! Continuing anyway...', extra=dict(width=width))
         if width != height:
             LOG.error("Source image should be square! Quitting...", extra=dict(width=width, height=height))
             sys.exit(1)
-    except UnidentifiedImageError:
+    except (UnidentifiedImageError, ValueError):
         LOG.error("Cannot open image file", extra=dict(input_path=str(input_path)))
         sys.exit(1)
 
+    if args.fog:
+        if image.mode not in shareable_modes:
+            LOG.error("Cannot apply fog to %s images", image.mode)
+            sys.exit(1)
+        try:
+            load_fog(args.fog, image.size)
+        except (OSError, UnidentifiedImageError):
+            LOG.error("Cannot open fog file", extra=dict(fog_path=str(args.fog)))
+            sys.exit(1)
+
     LOG.info(
         "Generating tiles for leaflet.js for zoom levels",
         extra=dict(zoom_min=zoom_min, zoom_max=zoom_max, output_path=str(output_path)),
     )
 
-    # if multiple zoom levels, run them all
-    for z in range(zoom_min, zoom_max + 1):
-        LOG.info("generate zoom level", extra=dict(zoom_level=z))
-        generate(image=image, outpath=output_path, zoom_level=z, resize_width=args.resize_width, format=args.format)
+    # Share the decoded image with a pool of workers rather than decoding it in each process
+    pool = None
+    if args.jobs > 1:
+        if isinstance(image, RawImage):
+            # Workers open the file themselves and read their own strips
+            pool = ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker, initargs=(image.spec(),))
+        elif image.mode in shareable_modes:
+            LOG.info("Sharing source image with worker processes", extra=dict(jobs=args.jobs))
+            shared = SharedImage.from_image(image)
+            image.close()
+            image = shared
+            pool = ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker, initargs=(shared.spec(),))
+        else:
+            LOG.warning('Cannot share %s images with workers, continuing with one job', image.mode)
+
+    # Hashes of the source of each tile so we only write the tiles that have changed since the last run
+    suffixes = ('', retina_suffix) if args.retina else ('',)
+    writer = TileWriter(output_path, format=args.format, dedup=args.dedup, suffixes=suffixes)
+    manifest_path = args.manifest or writer.manifest_path
+    move_old_manifest(output_path, manifest_path)
+    manifest = TileManifest(
+        manifest_path,
+        params=dict(resize_width=args.resize_width, format=args.format, quality=args.quality),
+        force=args.force,
+    )
+
+    options = TileOptions(
+        resize_width=args.resize_width,
+        format=args.format,
+        quality=args.quality,
+        fog=args.fog,
+        salt=manifest.salt,
+        dedup=args.dedup,
+        retina=args.retina,
+    )
+
+    level_args = dict(writer=writer, manifest=manifest, options=options, pool=pool, stats=stats)
+    try:
+        if args.pyramid:
+            # Only the deepest level is generated from the source image, the rest are built from the level below
+            LOG.info("generate zoom level", extra=dict(zoom_level=zoom_max))
+            tiles = generate(image=image, zoom_level=zoom_max, keep_tiles=zoom_max > zoom_min, **level_args)
+            manifest.save()
+            for z in range(zoom_max - 1, zoom_min - 1, -1):
+                LOG.info("generate zoom level", extra=dict(zoom_level=z))
+                tiles = generate_from_tiles(tiles=tiles, zoom_level=z, keep_tiles=z > zoom_min, **level_args)
+                manifest.save()
+        else:
+            # if multiple zoom levels, run them all
+            for z in range(zoom_min, zoom_max + 1):
+                LOG.info("generate zoom level", extra=dict(zoom_level=z))
+                generate(image=image, zoom_level=z, **level_args)
+                manifest.save()
+        if writer.duplicates:
+            LOG.info('%d duplicate tiles stored once', writer.duplicates)
+    finally:
+        if pool:
+            pool.shutdown()
+        writer.close()
+        image.close()
+
+    if args.stats:
+        args.stats.write_text(json.dumps(stats.to_json(), indent=2))
     # that's it!
     LOG.info('FINISHED!')
 
@@ -0,0 +1,41 @@
+import re
+from typing import Iterable, Optional
+
+
+# Decides whether an object type (class) is one we're interested in from a set of types and sets of
+# prefixes and suffixes (the marker_types/starts_with/ends_with rules in the game definitions).
+#
+# The prefixes and suffixes are compiled once into a regex each (the suffixes matched against the
+# reversed type) and the answer for each type is remembered, as the same few hundred types come up
+# again and again in the levels. match() gives the rule a type matched which is handy for debugging.
+class TypeClassifier:
+    def __init__(self, types: Iterable[str] = (), starts_with: Iterable[str] = (), ends_with: Iterable[str] = ()):
+        self.types = frozenset(types)
+        self.prefixes = TypeClassifier.compile(starts_with)
+        self.suffixes = TypeClassifier.compile(s[::-1] for s in ends_with)
+        self.matches = {}
+
+    # A regex matching any of the strings at the start, preferring the longest
+    @staticmethod
+    def compile(strings: Iterable[str]) -> Optional[re.Pattern]:
+        strings = sorted(set(strings), key=lambda s: (-len(s), s))
+        return re.compile('|'.join(map(re.escape, strings))) if strings else None
+
+    # The rule the type matches as (rule, string) where the rule is 'types', 'starts_with' or
+    # 'ends_with' and the string is the type, prefix or suffix it matched. None if it matches none
+    def match(self, otype: str) -> Optional[tuple[str, str]]:
+        if otype in self.matches:
+            return self.matches[otype]
+
+        found = None
+        if otype in self.types:
+            found = ('types', otype)
+        elif self.prefixes and (m := self.prefixes.match(otype)):
+            found = ('starts_with', m.group())
+        elif self.suffixes and (m := self.suffixes.match(otype[::-1])):
+            found = ('ends_with', m.group()[::-1])
+        self.matches[otype] = found
+        return found
+
+    def __contains__(self, otype: str) -> bool:
+        return self.match(otype) is not None
@@ -1,9 +1,25 @@
+import codecs
+import hashlib
+import io
 import json
+import locale
+import math
+import os
+import pickle
+import re
 from pathlib import Path
 import sys
-from typing import Any, Optional
+from typing import Any, Iterable, Iterator, Optional
+from .levelstore import LevelStore
 from .utils import JsonData
 
+# orjson is much faster at reading and writing the large level files but is optional, we fall back
+# on the json module if it isn't installed (pip install orjson)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # The following load/save functions make a path by joining all the varargs
 # together with '\\' and adding '.txt'
 #
@@ -19,22 +35,343 @@ from .utils import JsonData
 # Extension should not be included. Empty strings will be ignored/skipped
 
 
+# Decode JSON text (as bytes) to an object data structure. Uses orjson when it's available unless
+# the JSON is something only the json module accepts (NaN, huge integers...)
+def loads_json(data: bytes, fast: bool = True) -> JsonData:
+    data = data.removeprefix(b'\xef\xbb\xbf')
+    if orjson and fast:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data.decode('utf-8'))
+
+
+# orjson formats some floats differently from repr (which json uses): exponents are written without
+# the sign or leading zero (1e-7 rather than 1e-07) and 1e-5 <= abs(x) < 1e-4 without an exponent.
+# Numbers are found by these markers, the (much faster) alternative to a regex for a whole number
+orjson_float_marker_re = re.compile(r'e(?:-|[123][0-9])')
+orjson_small_float_marker = '0.0000'
+float_re = re.compile(r'-?[0-9][0-9.]*(?:e-?[0-9]+)?')
+
+
+# Rewrite the floats orjson formatted differently as repr would. With indenting every number is a
+# whole value at the end of a line (before any comma), so the text from the last space before a
+# marker to the end of the line must be a number for it to be one. That can't be true in a string.
+def fix_orjson_floats(text: str) -> str:
+    markers = [m.start() for m in orjson_float_marker_re.finditer(text)]
+    pos = text.find(orjson_small_float_marker)
+    while pos >= 0:
+        markers.append(pos)
+        pos = text.find(orjson_small_float_marker, pos + len(orjson_small_float_marker))
+    if not markers:
+        return text
+
+    pieces = []
+    done = 0
+    for pos in sorted(markers):
+        if pos < done:
+            continue
+        line_start = text.rfind('\n', 0, pos) + 1
+        start = text.rfind(' ', line_start, pos) + 1 or line_start
+        end = text.find('\n', pos)
+        end = len(text) if end < 0 else end
+        token = text[start:end].removesuffix(',')
+        if float_re.fullmatch(token):
+            pieces += [text[done:start], repr(float(token))]
+            done = start + len(token)
+    pieces.append(text[done:])
+    return ''.join(pieces)
+
+
+# Characters json escapes when ensure_ascii is set that orjson writes as UTF-8
+orjson_unescaped_re = re.compile('[\x7f-\U0010ffff]')
+
+
+def json_escape(match: re.Match) -> str:
+    c = ord(match[0])
+    if c < 0x10000:
+        return f'\\u{c:04x}'
+    c -= 0x10000
+    return f'\\u{0xD800 | (c >> 10):04x}\\u{0xDC00 | (c & 0x3FF):04x}'
+
+
+# Check for NaN or infinite floats which orjson writes as null (only done if there is a null)
+def has_nonfinite(data: JsonData) -> bool:
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, float):
+            if not math.isfinite(item):
+                return True
+        elif isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return False
+
+
+# Converts an object to JSON text, the same as json.dumps(data, indent=2). Uses orjson when it's
+# available and fixes up the few differences in its output (see above). Data orjson can't handle or
+# writes differently in ways that can't be fixed up (NaN is written as null) goes to the json module.
+# Minified JSON (for publishing) has no whitespace at all and non-ASCII characters aren't escaped.
+def dumps_json(data: JsonData, fast: bool = True, minify: bool = False) -> str:
+    if minify:
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+    if orjson and fast:
+        try:
+            encoded = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        except orjson.JSONEncodeError:
+            encoded = None
+        if encoded is not None and (b'null' not in encoded or not has_nonfinite(data)):
+            text = fix_orjson_floats(encoded.decode('utf-8'))
+            if not text.isascii() or '\x7f' in text:
+                text = orjson_unescaped_re.sub(json_escape, text)
+            return text
+    return json.dumps(data, indent=2)
+
+
+# Keys of the coordinates of a marker (lat/lng/alt) and of its targets (the target/targets x/y/z)
+marker_coordinate_keys = ('lat', 'lng', 'alt')
+target_keys = ('target', 'targets')
+target_coordinate_keys = ('x', 'y', 'z')
+
+
+# Returns a copy of d with the float values of the keys rounded to precision decimal places
+def round_keys(d: dict, keys: Iterable[str], precision: int) -> dict:
+    rounded = {k: round(v, precision) for k in keys if isinstance(v := d.get(k), float) and math.isfinite(v)}
+    return d | rounded if rounded else d
+
+
+# Returns a copy of a marker with its coordinates and those of its targets rounded
+def round_marker(marker: dict, precision: int) -> dict:
+    marker = round_keys(marker, marker_coordinate_keys, precision)
+    for key in target_keys:
+        if isinstance(target := marker.get(key), dict):
+            marker = marker | {key: round_keys(target, target_coordinate_keys, precision)}
+        elif isinstance(target, list):
+            targets = [round_keys(t, target_coordinate_keys, precision) if isinstance(t, dict) else t for t in target]
+            marker = marker | {key: targets}
+    return marker
+
+
+# Returns a copy of a list of markers (as in markers.*.json) with the float coordinates of the markers
+# and their targets rounded to precision decimal places. Anything else (other files' data, like the
+# map bounds in layerConfigs.json) is returned as it is
+def round_coordinates(data: JsonData, precision: int) -> JsonData:
+    if not isinstance(data, list):
+        return data
+    return [round_marker(o, precision) if isinstance(o, dict) else o for o in data]
+
+
 # Reads a json file and converts it do an object data structure
 def load_json_file(path: Path, quiet: bool = False):
     if not path.exists():
         sys.exit(f'{path} not found, exiting')
     if not quiet:
         print(f'Reading "{path}"...')
-    with path.open('r', encoding="utf-8-sig") as fh:
-        return json.load(fh)
+    return loads_json(path.read_bytes())
+
+
+# Encodes text as writing it to a file opened in text mode would (platform line endings and encoding)
+def encode_text(text: str) -> bytes:
+    encoding = locale.getencoding() if io.text_encoding(None) == 'locale' else 'utf-8'
+    return text.replace('\n', os.linesep).encode(encoding)
+
+
+# Writes data to a file unless the file already holds exactly that data, so files that haven't changed
+# aren't rewritten and keep their modification times. Otherwise the data is written to a temporary file
+# which then replaces the file, so an interrupted run can't leave a truncated file behind.
+# Returns True if the file was written.
+def save_file(data: bytes, path: Path, quiet: bool = False) -> bool:
+    if path.exists() and path.stat().st_size == len(data) and file_hash(path) == hashlib.blake2b(data).hexdigest():
+        if not quiet:
+            print(f'Unchanged "{path}"')
+        return False
+
+    if not quiet:
+        print(f'Writing "{path}"...')
+    temp_path = path.with_name(path.name + '.tmp')
+    try:
+        temp_path.write_bytes(data)
+        temp_path.replace(path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return True
 
 
 # Converts object to JSON format and writes it to the specified location
 def save_json_file(data: JsonData, path: Path, quiet: bool = False) -> None:
-    with path.open('w') as file:
+    save_file(data=encode_text(dumps_json(data)), path=path, quiet=quiet)
+
+
+json_whitespace_re = re.compile(r'[ \t\n\r]*')
+json_delimiters = frozenset(' \t\n\r,]')
+
+
+# Reads a json file holding a list (like the level files) and yields the items of the list one at a
+# time, so a pass over a level only needs memory for one object at a time rather than the whole level.
+# The file is read in chunks and each item decoded as soon as all of it has been read.
+def iter_json_array(  # noqa: C901 - disable complexity warning
+    path: Path, quiet: bool = False, chunk_size: int = 1 << 20
+) -> Iterator[JsonData]:
+    if not path.exists():
+        sys.exit(f'{path} not found, exiting')
+    if not quiet:
+        print(f'Reading "{path}"...')
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8-sig')()
+    with path.open('rb') as file:
+        text, pos, eof = '', 0, False
+
+        # Read another chunk of the file keeping the text from pos on
+        def read_more(size: int = chunk_size) -> None:
+            nonlocal text, pos, eof
+            chunk = file.read(size)
+            eof = not chunk
+            text, pos = text[pos:] + utf8.decode(chunk, final=eof), 0
+
+        # Skip whitespace and return the next character ('' at the end of the file)
+        def next_char() -> str:
+            nonlocal pos
+            while True:
+                pos = json_whitespace_re.match(text, pos).end()
+                if pos < len(text) or eof:
+                    return text[pos : pos + 1]
+                read_more()
+
+        if next_char() != '[':
+            sys.exit(f'{path} is not a JSON list, exiting')
+        pos += 1
+        if next_char() == ']':
+            return
+
+        # An item bigger than a chunk is read in doubling chunks so it isn't decoded over and over
+        size = chunk_size
+        while True:
+            # An item is complete once it decodes and is followed by a delimiter (a number could be cut off)
+            next_char()
+            try:
+                item, end = decoder.raw_decode(text, pos)
+                complete = eof or text[end : end + 1] in json_delimiters
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                read_more(size)
+                size *= 2
+                continue
+            size = chunk_size
+            yield item
+
+            pos = end
+            separator = next_char()
+            if separator == ']':
+                return
+            if separator != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, pos)
+            pos += 1
+
+
+# Writes the items as a JSON list, the same text as save_json_file(list(items)) but converting and
+# writing an item at a time. It's written to a temporary file which then replaces the original (if
+# it's different, as save_file) so items can come from iter_json_array on the same file.
+def save_json_array(items: Iterable[JsonData], path: Path, quiet: bool = False) -> None:
+    temp_path = path.with_name(path.name + '.tmp')
+    try:
+        with temp_path.open('w') as file:
+            separator = '[\n  '
+            for item in items:
+                file.write(separator + dumps_json(item).replace('\n', '\n  '))
+                separator = ',\n  '
+            file.write('[]' if separator == '[\n  ' else '\n]')
+        if (
+            path.exists()
+            and path.stat().st_size == temp_path.stat().st_size
+            and file_hash(path) == file_hash(temp_path)
+        ):
+            if not quiet:
+                print(f'Unchanged "{path}"')
+            temp_path.unlink()
+            return
         if not quiet:
             print(f'Writing "{path}"...')
-        json.dump(data, file, indent=2)
+        temp_path.replace(path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+# Level files are read into a LevelStore, streaming the objects into it so the whole decoded list is
+# never in memory. The stores are cached in a .cache directory next to the levels, pickled, which loads
+# many times faster than parsing the JSON. The cache starts with a header of the level file's size,
+# modification time and hash: a cache is used if the size and time match or, if only the time differs
+# (the file was copied or checked out again), if the hash of the contents still matches.
+level_cache_version = 2
+
+
+def level_cache_path(path: Path) -> Path:
+    return path.parent.joinpath('.cache', path.stem + '.pickle')
+
+
+def file_hash(path: Path) -> str:
+    with path.open('rb') as file:
+        return hashlib.file_digest(file, 'blake2b').hexdigest()
+
+
+# Remove the cached copy of a level, needed when the level file is rewritten
+def remove_level_cache(path: Path) -> None:
+    level_cache_path(path).unlink(missing_ok=True)
+
+
+# Reads a level json file into a LevelStore through the cache
+def load_level_file(path: Path, quiet: bool = False) -> LevelStore:
+    if not path.exists():
+        sys.exit(f'{path} not found, exiting')
+    stat = path.stat()
+    cache_path = level_cache_path(path)
+    header = {'version': level_cache_version, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    # A cache that can't be read (missing, truncated, from an older version...) just means reading
+    # the level file again, but other errors are bugs and are raised
+    try:
+        with cache_path.open('rb') as file:
+            cached = pickle.load(file)
+            if all(cached.get(key) == header[key] for key in ('version', 'size')):
+                same_mtime = cached.get('mtime') == header['mtime']
+                if same_mtime or cached.get('hash') == file_hash(path):
+                    if not quiet:
+                        print(f'Reading "{path}" (cached)...')
+                    level = pickle.load(file)
+                    if not same_mtime:
+                        save_level_cache(level, cache_path, header | {'hash': cached['hash']})
+                    return level
+    except FileNotFoundError:
+        pass
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError) as e:
+        print(f'Warning: discarding unreadable level cache "{cache_path}": {e!r}')
+
+    if not quiet:
+        print(f'Reading "{path}"...')
+    level = LevelStore(iter_json_array(path=path, quiet=True))
+    save_level_cache(level, cache_path, header | {'hash': file_hash(path)})
+    return level
+
+
+def save_level_cache(level: LevelStore, cache_path: Path, header: dict[str, Any]) -> None:
+    temp_path = cache_path.with_name(cache_path.name + '.tmp')
+    try:
+        cache_path.parent.mkdir(exist_ok=True)
+        with temp_path.open('wb') as file:
+            pickle.dump(header, file, protocol=5)
+            pickle.dump(level, file, protocol=5)
+        temp_path.replace(cache_path)
+    except OSError as e:
+        print(f'Warning: unable to cache level in "{cache_path}": {e}')
+        temp_path.unlink(missing_ok=True)
 
 
 # Load a text file into a string list with an entry for each line
@@ -49,11 +386,7 @@ def load_text_file(path: Path, quiet: Optional[bool] = False) -> list[str]:
 
 # Overwrite file with each string in lines list adding newline to each
 def save_text_file(lines: list[str], path: Path, quiet: Optional[bool] = False) -> None:
-    if not quiet:
-        print(f'Writing "{path}"...')
-    with path.open('w') as file:
-        for line in lines:
-            file.write(line + '\n')
+    save_file(data=encode_text(''.join(line + '\n' for line in lines)), path=path, quiet=quiet)
 
 
 # This file is generated using hard coded information and info from a save
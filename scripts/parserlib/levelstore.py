@@ -0,0 +1,116 @@
+import marshal
+from array import array
+from typing import Any, Iterable, Iterator
+
+from .utils import JsonData
+
+
+# A compact in memory form of a level file. The list of objects in a level is mostly a huge number
+# of small dicts, so rather than keep them the Type, Name and Outer of each object are kept as
+# indexes into a table of (interned) strings and everything else about an object (its Properties
+# etc) is kept marshalled and only decoded when it is looked at.
+#
+# It is used like the list of objects it replaces, level[index] giving the object at that index in
+# the level file (as referenced by objectRef) and iterating over it giving all the objects.
+class LevelStore:
+    columns = ('Type', 'Name', 'Outer')
+
+    def __init__(self, objects: Iterable[dict[str, JsonData]] = ()):
+        self.strings = [None]  # string 0 is used when an object doesn't have the key
+        self.string_ids = {}
+        self.values = {key: array('I') for key in LevelStore.columns}
+        self.fields = []
+        for obj in objects:
+            self.append(obj)
+
+    def intern(self, s: str | None) -> int:
+        if s is None:
+            return 0
+        if (sid := self.string_ids.get(s)) is None:
+            sid = self.string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return sid
+
+    def append(self, obj: dict[str, JsonData]) -> None:
+        for key, values in self.values.items():
+            values.append(self.intern(obj.get(key)))
+        fields = {key: value for key, value in obj.items() if key not in self.values}
+        self.fields.append(marshal.dumps(fields) if fields else b'')
+
+    def value(self, key: str, index: int) -> str | None:
+        return self.strings[self.values[key][index]]
+
+    def set_value(self, key: str, index: int, value: str) -> None:
+        self.values[key][index] = self.intern(value)
+
+    # Decode the rest of an object's fields, a new dict each time
+    def decode(self, index: int) -> dict[str, JsonData]:
+        return marshal.loads(data) if (data := self.fields[index]) else {}
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def __getitem__(self, index: int) -> 'LevelObject':
+        if not -len(self.fields) <= index < len(self.fields):
+            raise IndexError('level object index out of range')
+        return LevelObject(self, index % len(self.fields))
+
+    def __iter__(self) -> Iterator['LevelObject']:
+        return (LevelObject(self, index) for index in range(len(self.fields)))
+
+    # The lookup table is rebuilt rather than saved when pickled (for the level cache)
+    def __getstate__(self) -> dict[str, Any]:
+        return {'strings': self.strings, 'values': self.values, 'fields': self.fields}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.string_ids = {s: sid for sid, s in enumerate(self.strings) if sid}
+
+
+# An object in a LevelStore which can be used like the dict it was read from (o['Name'],
+# o.get('Properties', {}) etc). The fields other than Type, Name and Outer are decoded the first time
+# one of them is used. Type, Name and Outer can be set (the change is made to the store) but the other
+# fields can't, as the change would only be seen through this view of the object and lost for the
+# next. Use to_dict() for a copy that can be changed.
+class LevelObject:
+    __slots__ = ('store', 'index', 'fields')
+
+    def __init__(self, store: LevelStore, index: int):
+        self.store = store
+        self.index = index
+        self.fields = None
+
+    def load(self) -> dict[str, JsonData]:
+        if self.fields is None:
+            self.fields = self.store.decode(self.index)
+        return self.fields
+
+    def __getitem__(self, key: str) -> JsonData:
+        if key in LevelStore.columns:
+            if (value := self.store.value(key, self.index)) is None:
+                raise KeyError(key)
+            return value
+        return self.load()[key]
+
+    def get(self, key: str, default: JsonData = None) -> JsonData:
+        if key in LevelStore.columns:
+            value = self.store.value(key, self.index)
+            return default if value is None else value
+        return self.load().get(key, default)
+
+    def __contains__(self, key: str) -> bool:
+        if key in LevelStore.columns:
+            return self.store.value(key, self.index) is not None
+        return key in self.load()
+
+    def __setitem__(self, key: str, value: JsonData) -> None:
+        if key not in LevelStore.columns:
+            raise TypeError(
+                f'level object field {key!r} is read only (only {", ".join(LevelStore.columns)} can be set)'
+            )
+        self.store.set_value(key, self.index, value)
+
+    # The whole object as a dict
+    def to_dict(self) -> dict[str, JsonData]:
+        obj = {key: value for key in LevelStore.columns if (value := self.store.value(key, self.index)) is not None}
+        return obj | self.load()
@@ -1,162 +1,166 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
 from typing import Any, Optional
 
-import networkx as nx
 import numpy as np
-from libpysal import weights
-from mathutils import Matrix, Vector
-from sklearn.neighbors import KDTree
 
+from .classifier import TypeClassifier
 from .config import config
-from .fileio import read_savedpadpipes, load_json_file, save_json_file
+from .fileio import read_savedpadpipes, load_json_file, load_level_file, save_json_file
 from .gamedefs import colors, brick_types, price_types, exported_properties
+from .levelstore import LevelStore
 from .slgamedefs import marker_types, starts_with, ends_with, properties, slcoin_defaults
+from .transforms import TransformResolver, level_transforms, location, normalize, vectors
 from .utils import camel_to_snake
-from .utils import optColor, optKey, getVec, getRot, getQuat, getXYZ
+from .utils import optColor, optKey
 from .utils import objectRef
 
+# scikit-learn's KDTree and the terrain (scipy) are imported in the functions using them, they take
+# seconds to import and the processes reading the level files (index_level) don't need them
 
-def export_markers(game: str, datadir: Path, sourcedir: Path) -> None:  # noqa: C901 - disable complexity warning
-    maps = {}  # dictionary from map name to json data list
-    area_mtx = {}  # Transform for each area map geometry
+# The types of object we make markers for
+marker_classes = TypeClassifier(marker_types, starts_with, ends_with)
+
+
+# Phase 1 for one map: read the map json file in and find the links between pipes and any area/map
+# file transforms (for streaming levels). Run for each map in a pool of processes, so everything
+# returned must be picklable (the transforms are returned as read and made into matrices together).
+def index_level(sourcedir: Path, area: str) -> tuple[LevelStore, list[tuple[str, dict]], list[tuple[str, str]]]:
+    level = load_level_file(path=sourcedir.joinpath('levels', f"{area}.json"))
+    transforms = []
+    pipes = []
+
+    # Go through all objects in the map data and store lookups for later
+    for o in level:
+        if not o.get('Outer') or not (p := o.get('Properties')):
+            continue
+        otype = o['Type']
+
+        # For maps that are divided into multiple files, there may be a LevelTransform for entities in that
+        # file relative to the persistent world that is handled by the streaming system
+        if (a := p.get('WorldAsset', {}).get('AssetPathName')) and (t := p.get('LevelTransform')):
+            transforms.append((a.split('.').pop(), t))
+
+        if otype.startswith('Pipesystem') and 'Pipe' in p and ('OtherPipe' in p or 'otherPipeInOtherLevel' in p):
+            # p['Pipe']
+            #     ObjectName: StaticMeshComponent'DLC2_Complete:PersistentLevel.HealingStation13_44.Pipe'
+            #     ObjectPath: SupralandSIU/Content/FirstPersonBP/Maps/DLC2_Complete.58973
+            # p['OtherPipe']
+            #     ObjectName: PipesystemNew_C'DLC2_Complete:PersistentLevel.PipesystemNew10'
+            #     ObjectPath: SupralandSIU/Content/FirstPersonBP/Maps/DLC2_Complete.19652
+            # p['otherPipeInOtherLevel']
+            #     AssetPathName: /Game/FirstPersonBP/Maps/DLC2_Complete.DLC2_Complete
+            #     SubPathString: PersistentLevel.PipeToArea2
+            # {ComponentType/class}'{map}'
+            def getPipeObjectName(o):
+                t = o['ObjectName'].split('.')
+                r = t[-2] if t[-1] == "Pipe'" else t[-1]
+                return r.replace("'", "")
+
+            a = ':'.join((area, getPipeObjectName(p['Pipe'])))
+            if t := p.get('otherPipeInOtherLevel'):
+                b = ':'.join((t['AssetPathName'].split('.').pop(), t['SubPathString'].split('.').pop()))
+            else:
+                b = ':'.join((area, getPipeObjectName(p['OtherPipe'])))
+            pipes.append((a, b))
+            # pipes [b] = a # links may be single-sided
+
+    return level, transforms, pipes
+
+
+def export_markers(  # noqa: C901 - disable complexity warning
+    game: str, datadir: Path, sourcedir: Path, jobs: Optional[int] = None
+) -> None:
+    maps = {}  # dictionary from map name to LevelStore of its objects
+    area_transforms = []  # LevelTransform for each area map geometry (for streaming levels)
     data = []  # Output marker data
 
     pipes = {}
-    objects = {}
 
     data_lookup = {}
 
     # Phase 1: Read all the map json files in and build a look up table for references
-    # Also get any area/map file matrices (for streaming levels)
-    for area in config[game]['maps']:
-        # Store the map data
-        maps[area] = load_json_file(path=sourcedir.joinpath('levels', f"{area}.json"))
-
-        # Go through all objects in the map data and store lookups for later
-        for oidx, o in enumerate(maps[area]):
-            if not o.get('Outer') or not (p := o.get('Properties')):
-                continue
-            oname = o['Name']
-            otype = o['Type']
-
-            # For maps that are divided into multiple files, there may be a LevelTransform for entities in that
-            # file relative to the persistent world that is handled by the streaming system. To correct for this
-            # we construct a matrix from the Translation/Rotation members if they exit
-            if (a := p.get('WorldAsset', {}).get('AssetPathName')) and (t := p.get('LevelTransform')):
-                area_mtx[a.split('.').pop()] = (
-                    Matrix.Translation(getVec(t.get('Translation'))) @ getQuat(t.get('Rotation')).to_matrix().to_4x4()
-                )
-
-            if otype.startswith('Pipesystem') and 'Pipe' in p and ('OtherPipe' in p or 'otherPipeInOtherLevel' in p):
-                # p['Pipe']
-                #     ObjectName: StaticMeshComponent'DLC2_Complete:PersistentLevel.HealingStation13_44.Pipe'
-                #     ObjectPath: SupralandSIU/Content/FirstPersonBP/Maps/DLC2_Complete.58973
-                # p['OtherPipe']
-                #     ObjectName: PipesystemNew_C'DLC2_Complete:PersistentLevel.PipesystemNew10'
-                #     ObjectPath: SupralandSIU/Content/FirstPersonBP/Maps/DLC2_Complete.19652
-                # p['otherPipeInOtherLevel']
-                #     AssetPathName: /Game/FirstPersonBP/Maps/DLC2_Complete.DLC2_Complete
-                #     SubPathString: PersistentLevel.PipeToArea2
-                # {ComponentType/class}'{map}'
-                def getPipeObjectName(o):
-                    t = o['ObjectName'].split('.')
-                    r = t[-2] if t[-1] == "Pipe'" else t[-1]
-                    return r.replace("'", "")
-
-                a = ':'.join((area, getPipeObjectName(p['Pipe'])))
-                if t := p.get('otherPipeInOtherLevel'):
-                    b = ':'.join((t['AssetPathName'].split('.').pop(), t['SubPathString'].split('.').pop()))
-                else:
-                    b = ':'.join((area, getPipeObjectName(p['OtherPipe'])))
+    # Also get any area/map file matrices (for streaming levels). The maps are read and indexed in
+    # parallel (one process per map up to the number of CPUs by default) and merged in order.
+    areas = config[game]['maps']
+    jobs = min(jobs or os.cpu_count() or 1, len(areas))
+    with ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else nullcontext() as pool:
+        results = (pool.map if pool else map)(partial(index_level, sourcedir), areas)
+        for area, (level, transforms, level_pipes) in zip(areas, results):
+            # Store the map data
+            maps[area] = level
+
+            # Keep the level transforms to make into matrices
+            area_transforms.extend(transforms)
+
+            for a, b in level_pipes:
                 pipes[a] = b
                 print(f"{a} -> {b}")
-                # pipes [b] = a # links may be single-sided
 
-            objects[area + ':' + oname] = o
+    # Construct a matrix from the Translation/Rotation members of each level transform
+    area_mtx = dict(zip((a for a, _ in area_transforms), level_transforms([t for _, t in area_transforms])))
 
-    for area in maps:
-        for oidx, o in enumerate(maps[area]):
-            otype = o['Type']
-            oname = o['Name']
+    # Phase 2: Go through all the objects which have types we're interested in
+    def allowed_objects():
+        for area in maps:
+            for oidx, o in enumerate(maps[area]):
+                if o['Type'] not in marker_classes:
+                    continue
 
-            allowed_items = (
-                marker_types
-                and otype in marker_types
-                or any(otype.startswith(s) for s in starts_with)
-                or any(otype.endswith(s) for s in ends_with)
-            )
-            if not allowed_items:
-                continue
+                if not o.get('Outer') or not o.get('Properties'):
+                    continue
 
-            if not o.get('Outer') or not (p := o.get('Properties')):
-                continue
+                yield (area, oidx), o
+
+    # The world transforms of the objects are worked out in batches along with the objects
+    resolver = TransformResolver(maps, area_mtx)
+
+    for (area, _), o, matrix in resolver.world_matrices(allowed_objects()):
+        # some MetalBall_C are Anvils, do the replacement
+        if (
+            o['Type'] == 'MetalBall_C'
+            and o.get('Properties', {}).get('Mesh?', {}).get('ObjectName') == "StaticMesh'Anvil'"
+        ):
+            o['Type'] = 'Anvil_C'
+
+        # some RingRusty_C are pickaxes, cannot be determined by meshes
+        if game == 'sl' and o['Name'].startswith('RingRusty'):
+            for i in range(10, 16 + 1):
+                if o['Name'] == 'RingRusty' + str(i):
+                    o['Type'] = '_Pickaxe_C'
+                    # special type, an item
+
+        data.append({'name': o['Name'], 'type': o['Type'], 'area': area})
+        data_lookup[':'.join((area, o['Name']))] = data[-1]
 
-            def getObject(p):
-                ref = objectRef(p)
-                return maps[ref[0]][ref[1]]
-
-            def get_matrix(o, matrix=Matrix.Identity(4)):
-                p = o.get('Properties', {})
-
-                if p.get('RelativeLocation'):
-                    matrix = (
-                        Matrix.LocRotScale(
-                            getVec(p.get('RelativeLocation')),
-                            getRot(p.get('RelativeRotation')),
-                            getVec(p.get('RelativeScale3D'), 1),
-                        )
-                        @ matrix
-                    )
-
-                for prop in ['RootObject', 'RootComponent', 'DefaultSceneRoot', 'AttachParent']:
-                    if p.get(prop):
-                        return get_matrix(getObject(p[prop]), matrix)
-                return matrix
-
-            matrix = get_matrix(o)
-            if area in area_mtx:
-                matrix = area_mtx[area] @ matrix
-
-            # some MetalBall_C are Anvils, do the replacement
-            if (
-                o['Type'] == 'MetalBall_C'
-                and o.get('Properties', {}).get('Mesh?', {}).get('ObjectName') == "StaticMesh'Anvil'"
-            ):
-                o['Type'] = 'Anvil_C'
-
-            # some RingRusty_C are pickaxes, cannot be determined by meshes
-            if game == 'sl' and o['Name'].startswith('RingRusty'):
-                for i in range(10, 16 + 1):
-                    if o['Name'] == 'RingRusty' + str(i):
-                        o['Type'] = '_Pickaxe_C'
-                        # special type, an item
-
-            data.append({'name': o['Name'], 'type': o['Type'], 'area': area})
-            data_lookup[':'.join((area, o['Name']))] = data[-1]
-
-            t = matrix.to_translation()
-            data[-1].update({'lat': t.y, 'lng': t.x, 'alt': t.z})
-
-            p = o.get('Properties', {})
-
-            for key in properties:
-                optKey(data[-1], camel_to_snake(key), p.get(key))
-
-            def class_from_objectname(props: dict, prop: str):
-                c = props.get(prop, {}).get('ObjectName')
-                return c.split("'")[1] if c else None
-
-            optKey(data[-1], 'spawns', class_from_objectname(p, 'Spawnthing'))
-            optKey(data[-1], 'spawns', class_from_objectname(p, 'Class'))
-            optKey(data[-1], 'other_pipe', pipes.get(':'.join((area, o['Name']))))
-            optKey(data[-1], 'custom_color', optColor(p.get('CustomColor')))
-
-            if o['Type'] in ('Jumppad_C'):
-                optKey(data[-1], 'velocity', (v := p.get('Velocity')) and getXYZ(getVec(v)))
-                d = Vector((matrix[0][2], matrix[1][2], matrix[2][2]))
-                d.normalize()
-                data[-1].update({'direction': getXYZ(d)})
-                data[-1].update({'target': getXYZ(Vector((0, 0, 0)))})
+        x, y, z = location(matrix)
+        data[-1].update({'lat': y, 'lng': x, 'alt': z})
+
+        p = o.get('Properties', {})
+
+        for key in properties:
+            optKey(data[-1], camel_to_snake(key), p.get(key))
+
+        def class_from_objectname(props: dict, prop: str):
+            c = props.get(prop, {}).get('ObjectName')
+            return c.split("'")[1] if c else None
+
+        optKey(data[-1], 'spawns', class_from_objectname(p, 'Spawnthing'))
+        optKey(data[-1], 'spawns', class_from_objectname(p, 'Class'))
+        optKey(data[-1], 'other_pipe', pipes.get(':'.join((area, o['Name']))))
+        optKey(data[-1], 'custom_color', optColor(p.get('CustomColor')))
+
+        if o['Type'] in ('Jumppad_C'):
+            if v := p.get('Velocity'):
+                x, y, z = vectors([v])[0].tolist()
+                data[-1].update({'velocity': {'x': x, 'y': y, 'z': z}})
+            x, y, z = normalize(matrix[:3, 2]).tolist()
+            data[-1].update({'direction': {'x': x, 'y': y, 'z': z}})
+            data[-1].update({'target': {'x': 0.0, 'y': 0.0, 'z': 0.0}})
 
     calc_pads(data)
     calc_pipes(data)
@@ -182,6 +186,8 @@ def calc_pipes(data):
     if not points:
         return
 
+    from sklearn.neighbors import KDTree
+
     tree = KDTree(points)
 
     lookup = {}
@@ -198,7 +204,7 @@ def calc_pipes(data):
         indices = indices[0]
         j = data_indices[indices[0]]
         p = data[j]
-        dist = (Vector((x, y, z)) - Vector((p['lng'], p['lat'], p['alt']))).length
+        dist = math.dist((x, y, z), (p['lng'], p['lat'], p['alt']))
         if dist <= 1500:
             nearest_cap = p['area'] + ':' + p['name']
             cap_indices[nearest_cap] = j
@@ -226,8 +232,8 @@ def calc_pipes(data):
 
 def calc_pads(data):  # noqa: C901 - disable complexity warning
     # calculates target altitude from the jump pad's velocity data
-    # builds 3d terrain from selected points (uses jump pad locations by default)
-    # traces parabolic path and find z of an intersection with a plane defined by 3 closest points
+    # builds the terrain from selected points (uses jump pad locations by default)
+    # traces the parabolic paths and finds where they come down onto the terrain
 
     def allowed_points(o):
         # return True   # not recommended, bugs with coins, etc.
@@ -250,59 +256,39 @@ def calc_pads(data):  # noqa: C901 - disable complexity warning
     if not points:
         return
 
-    tree = KDTree(points)
+    from sklearn.neighbors import KDTree
+
+    from .terrain import Terrain
+
+    terrain = Terrain(points)
+    g = 9.8
+    m = 95
     jumppads = []
     matches = {}
+    starts = []
+    velocities = []
 
-    for i, o in enumerate(data):
+    for o in data:
         if o['type'] != 'Jumppad_C':
             continue
         jumppads.append(o)
         matches[':'.join((o['area'], o['name']))] = {'obj': o, 'targets': []}
 
-        x, y, z = o['lng'], o['lat'], o['alt']
         k = o.get('relative_velocity', 1000)
         v = o.get('direction', {'x': 0, 'y': 0, 'z': 0})
-
-        vx = v['x'] * k
-        vy = v['y'] * k
-        vz = v['z'] * k
+        velocity = (v['x'] * k, v['y'] * k, v['z'] * k)
 
         if (v := o.get('velocity')) and o.get('allow_stomp'):
-            vx = v['x']
-            vy = v['y']
-            vz = v['z']
+            velocity = (v['x'], v['y'], v['z'])
 
-        dt = 0.01
-        g = 9.8
-        m = 95
-        h = 0
-        t = 0
-        last_z = z
-        s = Vector((x, y, z))
-        while t < 20:
-            vz -= g * m * dt
-            x += vx * dt
-            y += vy * dt
-            z += vz * dt
-            t += dt
-
-            query_point = [x, y, z]
-            _, indices = tree.query([query_point], k=3)
-            indices = indices[0]
-            triangle = [points[j] for j in indices]
-            h = get_z(x, y, triangle)
-
-            dist = (Vector((x, y, z)) - s).length
-
-            # print([round(v, 2) for v in [x, y, z]], 'h', round(h, 2), 'nearest triangle', [ data[data_indices[j]]['name']+':'+str([round(x, 2)for x in points[j]]) for j in indices])
-            if dist > 250 and last_z > z and h > z:  # only check on decline
-                break
-
-            last_z = z
-
-        # print('pad', o['name'], 'velocity', vx, vy, vz, 'target', x, y, z)
-        data[i].update({'target': {'x': x, 'y': y, 'z': z}})
+        starts.append((o['lng'], o['lat'], o['alt']))
+        velocities.append(velocity)
+
+    # The first place each path comes down onto the terrain, at least 250 from the pad (or where it
+    # is after 20 seconds)
+    landings = terrain.landings(starts, velocities, g * m, min_distance=250, max_time=20)
+    for o, target in zip(jumppads, landings.tolist()):
+        o.update({'target': dict(zip('xyz', target))})
 
     # Now we try to find pairs of jumppads. For each jump pad, find all the other jumppads close to the target
     # If two jumppads are both in each other's lists then we can consider merging
@@ -317,39 +303,41 @@ def calc_pads(data):  # noqa: C901 - disable complexity warning
             vx = v['x']
             vy = v['y']
             vz = v['z']
-        return Vector((vx, vy, vz)).normalized()
-
-    for o in jumppads:
-        if abs(getdir(o).z) > 0.99:
-            continue
+        return vx, vy, vz
 
-        ov = Vector((o['lng'], o['lat'], 0))
-        otv = Vector((o['target']['x'], o['target']['y'], 0))
-        do = (otv - ov).normalized()
-
-        tdist = (otv - ov).length  # Distance between object and its target
-
-        for tj in jumppads:
-            if tj is o:
-                continue
-            if abs(getdir(tj).z) > 0.99:
-                continue
+    if not jumppads:
+        return
 
-            jv = Vector((tj['lng'], tj['lat'], 0))
-            jtv = Vector((tj['target']['x'], tj['target']['y'], 0))
-            dt = (jtv - jv).normalized()
+    # The pads and their targets (flattened onto x, y), pads pointing straight up aren't paired
+    pads = np.array([(o['lng'], o['lat']) for o in jumppads])
+    targets = np.array([(o['target']['x'], o['target']['y']) for o in jumppads])
+    upright = np.abs(normalized(np.array([getdir(o) for o in jumppads]))[:, 2]) > 0.99
+    headings = normalized(targets - pads)
+    tdists = np.linalg.norm(targets - pads, axis=1)  # Distance between each pad and its target
 
-            no2j = (jv - ov).normalized()
-            dist = (otv - jv).length
-            # distance between target and prospective match
+    # The prospective matches are the pads near each pad's target (a fraction of the distance to it)
+    nearby = KDTree(pads).query_radius(targets, r=0.3 * tdists)
 
-            # Distance threshold is compared to the distance between the pads
-            # Check that the pads are pointing in opposite directions
-            # And that the pads are facing each other (rather than opposite directions)
-            if dist < 0.3 * tdist and do.dot(dt) < -0.98 and no2j.dot(do) > 0.97 and no2j.dot(dt) < -0.97:
-                # print(o['name'], tj['name'], do.dot(dt), no2j.dot(do), no2j.dot(-dt), round(dist/tdist, 2))
-                alt = ':'.join((o['area'], o['name']))
-                matches[alt]['targets'].append(tj)
+    for i, o in enumerate(jumppads):
+        if upright[i]:
+            continue
+        js = np.sort(nearby[i])
+        js = js[(js != i) & ~upright[js]]
+
+        dist = np.linalg.norm(targets[i] - pads[js], axis=1)  # distance between target and prospective match
+        no2j = normalized(pads[js] - pads[i])
+
+        # Distance threshold is compared to the distance between the pads
+        # Check that the pads are pointing in opposite directions
+        # And that the pads are facing each other (rather than opposite directions)
+        paired = (
+            (dist < 0.3 * tdists[i])
+            & (headings[js] @ headings[i] < -0.98)
+            & (no2j @ headings[i] > 0.97)
+            & ((no2j * headings[js]).sum(axis=1) < -0.97)
+        )
+        alt = ':'.join((o['area'], o['name']))
+        matches[alt]['targets'].extend(jumppads[j] for j in js[paired])
 
     plist = {}
     for m in matches.values():
@@ -374,22 +362,10 @@ def calc_pads(data):  # noqa: C901 - disable complexity warning
                         t['other_pad'] = ':'.join((o['area'], o['name']))
 
 
-def get_z(x, y, triangle):
-    v1, v2, v3 = triangle
-    denominator = (v2[1] - v3[1]) * (v1[0] - v3[0]) + (v3[0] - v2[0]) * (v1[1] - v3[1])
-    if denominator == 0:
-        return v1[2]
-    alpha = ((v2[1] - v3[1]) * (x - v3[0]) + (v3[0] - v2[0]) * (y - v3[1])) / denominator
-    beta = ((v3[1] - v1[1]) * (x - v3[0]) + (v1[0] - v3[0]) * (y - v3[1])) / denominator
-    gamma = 1 - alpha - beta
-    if alpha >= 0 and beta >= 0 and gamma >= 0:
-        z = alpha * v1[2] + beta * v2[2] + gamma * v3[2]
-    else:
-        alpha = max(0, min(1, alpha))
-        beta = max(0, min(1, beta))
-        gamma = 1 - alpha - beta
-        z = alpha * v1[2] + beta * v2[2] + gamma * v3[2]
-    return z
+# The vectors (rows) scaled to unit length, zero length ones are left as they are
+def normalized(vectors: np.ndarray) -> np.ndarray:
+    lengths = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, lengths, out=np.zeros_like(vectors), where=lengths > 0)
 
 
 # The purpose of this code is to walk through all the objects we've gathered and prepare them for
@@ -554,15 +530,13 @@ def create_coinstacks(data_lookup, data) -> None:
     if len(points) == 0:
         return
 
-    # Creates a graph of connected elements that are within the distance threshold ie sets of
-    # points that all fit within a sphere of max radius 'threshold'
-    graph = weights.DistanceBand.from_array(points, threshold=threshold, silence_warnings=True).to_networkx()
+    # Finds the sets of points that are connected by being within the distance threshold of each other
 
     # Create an array of new stack objects to add and a list of old coin indices to remove
     stackId = 0
     stacks = []
     delobj = []
-    for cc in nx.connected_components(graph):
+    for cc in distance_clusters(points, threshold):
         # Note inc should be adfter the condition however there is custom
         # data depending on the number now and it only matters they are unique
         stackId += 1
@@ -592,11 +566,43 @@ def create_coinstacks(data_lookup, data) -> None:
 
     # Delete the old coins and add the new ones - we don't bother clearing out data_lookup
     delcount = len(delobj)
-    for o in delobj:
-        data.remove(o)
+    removed = {id(o) for o in delobj}
+    data[:] = [o for o in data if id(o) not in removed]
 
     for stack in stacks:
         data.append(stack)
         data_lookup[':'.join((stack['area'], stack['name']))] = stack
 
     print(f'Replaced {delcount} coins with {len(stacks)} stacks')
+
+
+# The groups of points (as sets of their indices) linked by being within threshold of each other,
+# the connected components of the graph libpysal's DistanceBand made (points at the same place aren't
+# linked directly). The groups are in order of their lowest index and each set is filled breadth
+# first from it as networkx's connected_components did, so iterating over the sets (and summing the
+# positions etc) gives the same order as before.
+def distance_clusters(points: list, threshold: float) -> list[set[int]]:
+    from sklearn.neighbors import KDTree
+
+    indices, distances = KDTree(points).query_radius(points, r=threshold, return_distance=True)
+    neighbours = [np.sort(i[d > 0]).tolist() for i, d in zip(indices, distances)]
+
+    clusters = []
+    clustered = [False] * len(points)
+    for first in range(len(points)):
+        if clustered[first]:
+            continue
+        cluster = {first}
+        level = [first]
+        while level:
+            next_level = []
+            for i in level:
+                for j in neighbours[i]:
+                    if j not in cluster:
+                        cluster.add(j)
+                        next_level.append(j)
+            level = next_level
+        for i in cluster:
+            clustered[i] = True
+        clusters.append(cluster)
+    return clusters
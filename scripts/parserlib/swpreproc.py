@@ -1,5 +1,14 @@
 from pathlib import Path
-from .fileio import load_json_file, save_json_file, save_text_file, load_filelist, save_assetlist
+from .fileio import (
+    iter_json_array,
+    load_json_file,
+    save_json_array,
+    save_json_file,
+    save_text_file,
+    load_filelist,
+    remove_level_cache,
+    save_assetlist,
+)
 from .ueenum import isenum, isueenum, load_all_enumbp
 
 
@@ -34,10 +43,10 @@ def preproc_levels(game: str, datadir: Path, sourcedir: Path) -> None:  # noqa:
         area = filestr[filestr.rfind('\\') + 1 : -5]
         area_names.add(area)
 
-        # Read the level file in and loop through the outer list of objects)
-        level = load_json_file(path=filename)
-        level_changed = False
-        for obj in level:
+        # Read the level file an object at a time (they can be very large) and loop through them,
+        # remembering which objects had enumerations remapped
+        changed_objects = set()
+        for index, obj in enumerate(iter_json_array(path=filename)):
             if (
                 not (otype := obj.get('Type'))
                 or not (oname := obj.get('Name'))
@@ -105,7 +114,7 @@ def preproc_levels(game: str, datadir: Path, sourcedir: Path) -> None:  # noqa:
             # Walk all data in the level remembering property names/types
             # Any enum types used and if possible remap enum attributes to source names
             def gather_properties(obj: dict, setkey: str):
-                nonlocal level_changed
+                nonlocal object_changed
 
                 for ref, value in obj.items() if isinstance(obj, dict) else enumerate(obj):
                     proptype = type(value).__name__
@@ -115,7 +124,7 @@ def preproc_levels(game: str, datadir: Path, sourcedir: Path) -> None:  # noqa:
                         if isueenum(value):
                             if source := ueenums.ue2source(value):
                                 obj[ref] = source
-                                level_changed = True
+                                object_changed = True
 
                     if isinstance(obj, dict):
                         otype = None
@@ -139,11 +148,18 @@ def preproc_levels(game: str, datadir: Path, sourcedir: Path) -> None:  # noqa:
                     if isinstance(value, (dict, list)):
                         gather_properties(obj=value, setkey='Properties' if ref == 'Properties' else 'Other')
 
+            object_changed = False
             gather_properties(obj=obj, setkey='Root')
-
-        # If we changed this level map's enumerations then write it out again
-        if level_changed:
-            save_json_file(data=level, path=filename)
+            if object_changed:
+                changed_objects.add(index)
+
+        # If we changed this level map's enumerations then write it out again, reading it a second time
+        # so the whole level is never held in memory and remapping the same objects as the first pass
+        if changed_objects:
+            objects = iter_json_array(path=filename, quiet=True)
+            items = (ueenums.to_source(obj) if i in changed_objects else obj for i, obj in enumerate(objects))
+            save_json_array(items=items, path=filename)
+            remove_level_cache(filename)
 
     save_assetlist(items=bp_assetlist, filelist=gamefilelist, path=sourcedir.joinpath('bpassetlist.txt'))
     save_assetlist(
@@ -0,0 +1,72 @@
+import numpy as np
+from scipy.spatial import KDTree
+
+
+# The ground given by a set of (x, y, z) points (the positions of markers), built once and used for any
+# number of lookups. The ground at a position is interpolated across the triangle of the 3 points
+# nearest to it (in 3D), clamped to the triangle's edges, the same everywhere (there's no edge to the
+# terrain, far from the points the nearest 3 still give the height).
+#
+# heights() looks up the ground at any number of positions and landings() finds where ballistic
+# paths come down onto it, all the paths being traced together a time step at a time.
+class Terrain:
+    def __init__(self, points: np.ndarray):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 3)
+        if len(self.points) < 3:
+            self.points = np.resize(self.points, (3, 3))  # repeated points make a flat triangle
+        self.tree = KDTree(self.points)
+
+    # The ground height at the (n, 3) positions
+    def heights(self, positions: np.ndarray) -> np.ndarray:
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        _, indices = self.tree.query(positions, k=3)
+        return interpolate(positions[:, 0], positions[:, 1], self.points[indices])
+
+    # Where the paths from the (n, 3) starts with the (n, 3) velocities and falling with gravity
+    # first come down below the ground (going down and at least min_distance from their start), as
+    # an (n, 3) array. A path which hasn't by max_time is where it is then
+    def landings(
+        self,
+        starts: np.ndarray,
+        velocities: np.ndarray,
+        gravity: float,
+        min_distance: float,
+        max_time: float,
+        dt: float = 0.01,
+    ) -> np.ndarray:
+        starts = np.asarray(starts, dtype=float).reshape(-1, 3)
+        x, y, z = starts.T.copy()
+        vx, vy, vz = np.asarray(velocities, dtype=float).reshape(-1, 3).T.copy()
+        last_z = z.copy()
+        active = np.arange(len(starts))
+        t = 0
+        while t < max_time and len(active):
+            vz[active] -= gravity * dt
+            x[active] += vx[active] * dt
+            y[active] += vy[active] * dt
+            z[active] += vz[active] * dt
+            t += dt
+
+            positions = np.column_stack((x[active], y[active], z[active]))
+            h = self.heights(positions)
+            distance = np.sqrt(((positions - starts[active]) ** 2).sum(axis=1))
+
+            landed = (distance > min_distance) & (last_z[active] > z[active]) & (h > z[active])
+            active = active[~landed]
+            last_z[active] = z[active]
+        return np.column_stack((x, y, z))
+
+
+# The heights at x, y (arrays) of the planes through (n, 3, 3) triangles of points, with the
+# barycentric weights clamped so positions outside a triangle get the height at its edge
+def interpolate(x: np.ndarray, y: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    v1, v2, v3 = triangles[:, 0].T, triangles[:, 1].T, triangles[:, 2].T
+    denominator = (v2[1] - v3[1]) * (v1[0] - v3[0]) + (v3[0] - v2[0]) * (v1[1] - v3[1])
+    flat = denominator == 0
+    denominator = np.where(flat, 1, denominator)
+    alpha = ((v2[1] - v3[1]) * (x - v3[0]) + (v3[0] - v2[0]) * (y - v3[1])) / denominator
+    beta = ((v3[1] - v1[1]) * (x - v3[0]) + (v1[0] - v3[0]) * (y - v3[1])) / denominator
+    alpha = np.clip(alpha, 0, 1)
+    beta = np.clip(beta, 0, 1)
+    gamma = 1 - alpha - beta
+    return np.where(flat, v1[2], alpha * v1[2] + beta * v2[2] + gamma * v3[2])
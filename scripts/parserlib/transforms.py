@@ -0,0 +1,190 @@
+from itertools import islice
+from math import sqrt
+from operator import itemgetter
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from .utils import JsonData, objectRef
+
+type ObjectKey = tuple[str, int]  # (area, index) of an object in the level maps
+
+xyz = itemgetter('X', 'Y', 'Z')
+wxyz = itemgetter('W', 'X', 'Y', 'Z')
+
+# The transforms are worked out in single precision with the same arithmetic as mathutils (which
+# the exports used before): each value is stored as a float32, while the sums of products in rotations
+# and matrix products are done in double precision and rounded once at the end. The exported
+# coordinates are then the same to the last digit as they have always been.
+float32 = np.float32
+identity = np.identity(4, dtype=float32)
+
+
+# Vectors as an (n, 3) array from a list of UE {'X', 'Y', 'Z'} dicts (default for missing ones)
+def vectors(items: list[Optional[dict]], default: float = 0) -> np.ndarray:
+    return np.array([xyz(d) if d else (default,) * 3 for d in items], dtype=float32).reshape(-1, 3)
+
+
+# Rotation matrices as an (n, 3, 3) array from a list of UE {'Pitch', 'Yaw', 'Roll'} dicts (in degrees).
+# These are XYZ euler angles of -Roll, -Pitch and Yaw, rotating about X then Y then Z
+def rotation_matrices(items: list[Optional[dict]]) -> np.ndarray:
+    angles = np.array([(-d['Roll'], -d['Pitch'], d['Yaw']) if d else (0, 0, 0) for d in items], dtype=float)
+    angles = np.radians(angles.reshape(-1, 3).T).astype(float32).astype(float)
+    cx, cy, cz = np.cos(angles)
+    sx, sy, sz = np.sin(angles)
+    cc, cs, sc, ss = cx * cz, cx * sz, sx * cz, sx * sz
+    return np.stack(
+        [
+            np.stack([cy * cz, sy * sc - cs, sy * cc + ss], axis=-1),
+            np.stack([cy * sz, sy * ss + cc, sy * cs - sc], axis=-1),
+            np.stack([-sy, cy * sx, cy * cx], axis=-1),
+        ],
+        axis=-2,
+    ).astype(float32)
+
+
+# Rotation matrices as an (n, 3, 3) array from a list of UE {'W', 'X', 'Y', 'Z'} quaternion dicts
+def quaternion_matrices(items: list[Optional[dict]]) -> np.ndarray:
+    quaternions = np.array([wxyz(d) if d else (0, 0, 0, 0) for d in items], dtype=float32)
+    w, x, y, z = sqrt(2) * quaternions.reshape(-1, 4).T.astype(float)
+    return np.stack(
+        [
+            np.stack([1 - y * y - z * z, x * y - w * z, x * z + w * y], axis=-1),
+            np.stack([w * z + x * y, 1 - x * x - z * z, y * z - w * x], axis=-1),
+            np.stack([x * z - w * y, w * x + y * z, 1 - x * x - y * y], axis=-1),
+        ],
+        axis=-2,
+    ).astype(float32)
+
+
+# 4x4 matrices as an (n, 4, 4) array from (n, 3) locations, (n, 3, 3) rotations and (n, 3) scales
+def compose_matrices(locations: np.ndarray, rotations: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    matrices = np.zeros((len(locations), 4, 4), dtype=float32)
+    matrices[:, :3, :3] = rotations if scales is None else rotations * scales[:, np.newaxis, :]
+    matrices[:, :3, 3] = locations
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+# The products a @ b of (n, 4, 4) arrays of matrices, each single precision product summed in double
+# precision in order and the sum rounded
+def multiply(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    sums = np.zeros(np.broadcast_shapes(a.shape, b.shape))
+    for i in range(a.shape[-1]):
+        sums += a[..., :, i, np.newaxis] * b[..., np.newaxis, i, :]
+    return sums.astype(float32)
+
+
+# The (n, 3) vectors scaled to unit length (zero where they have no length)
+def normalize(v: np.ndarray) -> np.ndarray:
+    lengths = np.sqrt((v.astype(float) ** 2).sum(axis=-1)).astype(float32)
+    scale = np.divide(float32(1), lengths, out=np.zeros_like(lengths), where=lengths > 0)
+    return v * scale[..., np.newaxis]
+
+
+# The location of a world matrix
+def location(matrix: np.ndarray) -> tuple[float, float, float]:
+    return tuple(matrix[:3, 3].tolist())
+
+
+# The matrices of a list of LevelTransforms (Translation/Rotation) of streaming levels
+def level_transforms(items: list[dict]) -> np.ndarray:
+    translations = compose_matrices(vectors([t.get('Translation') for t in items]), np.identity(3, dtype=float32))
+    rotations = compose_matrices(np.zeros((len(items), 3)), quaternion_matrices([t.get('Rotation') for t in items]))
+    return multiply(translations, rotations)
+
+
+# Works out the world transform of objects in the level maps from their RelativeLocation/Rotation/Scale
+# and the chain of components they are attached to (RootComponent, AttachParent...), and the transform
+# of the level they are in (area_mtx).
+#
+# The objects are taken in batches: the local matrices of the objects in a batch and of any of their
+# parents not seen before are made together as arrays and kept, so each is only made once. The world
+# matrices of a batch are then composed together a step up the hierarchy at a time, starting from the
+# objects and applying each parent's local matrix in turn (as the products are rounded, they have to
+# be taken in the same order for the results to be the same).
+class TransformResolver:
+    parent_props = ['RootObject', 'RootComponent', 'DefaultSceneRoot', 'AttachParent']
+
+    def __init__(self, maps: dict, area_matrices: Optional[dict[str, np.ndarray]] = None):
+        self.maps = maps
+        self.area_matrices = area_matrices or {}
+        self.rows = {}  # row of each object in the arrays below
+        self.count = 0  # rows in use (the arrays have room to add more)
+        self.parents = np.empty(0, dtype=int)  # row of the parent of each object (-1 if it has none)
+        self.locals = np.empty((0, 4, 4), dtype=float32)  # local matrix of each object
+        self.has_local = np.empty(0, dtype=bool)  # whether the object has a local transform
+
+    # The world matrices of the objects as (key, object, matrix) with the objects as they were given
+    # (key, object) as the LevelObject is reused to get the transform properties
+    def world_matrices(
+        self, objects: Iterable[tuple[ObjectKey, JsonData]], batch_size: int = 4096
+    ) -> Iterator[tuple[ObjectKey, JsonData, np.ndarray]]:
+        objects = iter(objects)
+        while batch := list(islice(objects, batch_size)):
+            matrices = self.compose(np.array(self.add_objects(batch)))
+            in_area = {}
+            for i, (key, _) in enumerate(batch):
+                if key[0] in self.area_matrices:
+                    in_area.setdefault(key[0], []).append(i)
+            for area, rows in in_area.items():
+                matrices[rows] = multiply(self.area_matrices[area], matrices[rows])
+            for (key, o), matrix in zip(batch, matrices):
+                yield key, o, matrix
+
+    # The world matrices of the objects in the rows, applying the local matrices from each object up
+    def compose(self, rows: np.ndarray) -> np.ndarray:
+        matrices = np.tile(identity, (len(rows), 1, 1))
+        index = np.arange(len(rows))
+        while len(rows):
+            step = self.has_local[rows]
+            matrices[index[step]] = multiply(self.locals[rows[step]], matrices[index[step]])
+            rows = self.parents[rows]
+            index, rows = index[rows >= 0], rows[rows >= 0]
+        return matrices
+
+    # The object and its parents up to the first one already added as (key, properties, parent key)
+    def new_ancestors(self, key: ObjectKey, o: JsonData) -> list[tuple[ObjectKey, dict, Optional[ObjectKey]]]:
+        chain = []
+        while key not in self.rows:
+            p = o.get('Properties', {})
+            parent = None
+            for prop in self.parent_props:
+                if ref := p.get(prop):
+                    parent = tuple(objectRef(ref))
+                    break
+            self.rows[key] = self.count + len(chain)
+            chain.append((key, p, parent))
+            if parent is None:
+                break
+            key, o = parent, self.maps[parent[0]][parent[1]]
+        return chain
+
+    # Add the objects and any of their parents not already added, returning the rows of the objects
+    def add_objects(self, batch: list[tuple[ObjectKey, JsonData]]) -> list[int]:
+        first = self.count
+        parents = []  # keys of the parents of the new rows
+        local_rows, locations, rotations, scales = [], [], [], []
+        for obj_key, o in batch:
+            for key, p, parent in self.new_ancestors(obj_key, o):
+                if location := p.get('RelativeLocation'):
+                    local_rows.append(self.count)
+                    locations.append(location)
+                    rotations.append(p.get('RelativeRotation'))
+                    scales.append(p.get('RelativeScale3D'))
+                parents.append(parent)
+                self.count += 1
+        rows = [self.rows[key] for key, _ in batch]
+        if not parents:
+            return rows
+
+        if self.count > len(self.parents):
+            size = max(self.count, 2 * len(self.parents))
+            self.parents = np.resize(self.parents, size)
+            self.locals = np.resize(self.locals, (size, 4, 4))
+            self.has_local = np.resize(self.has_local, size)
+        self.parents[first : self.count] = [self.rows[parent] if parent else -1 for parent in parents]
+        self.has_local[first : self.count] = False
+        self.has_local[local_rows] = True
+        self.locals[local_rows] = compose_matrices(vectors(locations), rotation_matrices(rotations), vectors(scales, 1))
+        return rows
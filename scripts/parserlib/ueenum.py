@@ -58,6 +58,18 @@ class UEEnums:
     def match(self, ue: str, s: str) -> bool:
         return ue == s or self.ue2source(ue) == s
 
+    # Convert any UE renamed enumerations we know of anywhere in data to their source form (in place)
+    def to_source(self, data: Any) -> Any:
+        stack = [data]
+        while stack:
+            item = stack.pop()
+            for ref, value in item.items() if isinstance(item, dict) else enumerate(item):
+                if isenum(value) and isueenum(value) and (source := self.ue2source(value)):
+                    item[ref] = source
+                elif isinstance(value, (dict, list)):
+                    stack.append(value)
+        return data
+
     # If first argument is a UE enum then add it
     def addueattr(self, ue: str, s: Optional[str] = None) -> None:
         if isueenum(ue):
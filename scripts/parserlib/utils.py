@@ -1,10 +1,7 @@
 from itertools import groupby
-from math import radians
 import re
 from typing import Any, Optional
 
-from mathutils import Euler, Quaternion, Vector
-
 type JsonData = Any
 
 
@@ -56,22 +53,6 @@ def optKey(d, k, v):
     return v is not None and d.__setitem__(k, optEnum(v))
 
 
-def getVec(d, v=0):
-    return Vector((d['X'], d['Y'], d['Z'])) if d else Vector((v, v, v))
-
-
-def getRot(d, v=0):
-    return Euler((radians(-d['Roll']), -radians(d['Pitch']), radians(d['Yaw']))) if d else Euler((v, v, v))
-
-
-def getQuat(d, v=0):
-    return Quaternion((d['W'], d['X'], d['Y'], d['Z'])) if d else Quaternion((v, v, v, v))
-
-
-def getXYZ(v):
-    return dict(x=v.x, y=v.y, z=v.z)
-
-
 '''
     References to other UE objects the level files and blueprints often use a pair
     of strings:
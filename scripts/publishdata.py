@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Prepare the web map data files for publishing
+
+Writes every JSON file in the data directory minified, with the marker coordinates rounded, and
+writes .gz and .br (if brotli is installed: pip install brotli) compressed copies alongside every
+file so a static host can serve precompressed files. Run it on the built site, eg:
+    npm run build
+    uv run publishdata.py
+which publishes ..\\public\\data to ..\\dist\\data. The source files are left as they are unless the
+output directory is the same as the source.
+"""
+
+import gzip
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+from parserlib.fileio import dumps_json, loads_json, round_coordinates
+
+# brotli compresses better than gzip but is optional
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+compressed_suffixes = ('.gz', '.br')
+
+
+def publish_file(source: Path, output: Path, precision: int) -> list[int]:
+    """
+    writes one file (minified if it is JSON) and its compressed copies, returning their sizes
+    """
+    data = source.read_bytes()
+    if source.suffix == '.json':
+        data = dumps_json(round_coordinates(loads_json(data), precision), minify=True).encode('utf-8')
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_bytes(data)
+    sizes = [len(data)]
+
+    compressed = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli:
+        compressed.append(('.br', brotli.compress(data, quality=11)))
+    for suffix, packed in compressed:
+        output.with_name(output.name + suffix).write_bytes(packed)
+        sizes.append(len(packed))
+    return sizes
+
+
+def main() -> None:
+    data_path = Path(__file__).parent.parent.joinpath('public', 'data')
+    parser = ArgumentParser(description='Minify and precompress the web map data files')
+    parser.add_argument('source', type=Path, nargs='?', default=data_path, help='data directory (default public/data)')
+    parser.add_argument(
+        '-o', '--output', type=Path, help='directory to write the published files to (default dist/data)'
+    )
+    parser.add_argument('-p', '--precision', type=int, default=2, help='decimal places kept in coordinates (default 2)')
+    args = parser.parse_args()
+    output_path = args.output or Path(__file__).parent.parent.joinpath('dist', 'data')
+
+    if not args.source.is_dir():
+        sys.exit(f'{args.source} not found, exiting')
+    if not brotli:
+        print('Warning: brotli is not installed (pip install brotli) so only .gz files will be written')
+
+    files = sorted(path for path in args.source.rglob('*') if path.is_file() and path.suffix not in compressed_suffixes)
+    columns = ['original', 'published', 'gzip'] + (['brotli'] if brotli else [])
+    totals = [0] * len(columns)
+    print(f"{'file':<32} " + ' '.join(f'{name:>10}' for name in columns))
+    for path in files:
+        name = str(path.relative_to(args.source))
+        sizes = [path.stat().st_size] + publish_file(path, output_path.joinpath(name), args.precision)
+        totals = [total + size for total, size in zip(totals, sizes)]
+        print(f'{name:<32} ' + ' '.join(f'{size:>10}' for size in sizes))
+    print(f"{'total':<32} " + ' '.join(f'{size:>10}' for size in totals))
+
+
+if __name__ == '__main__':
+    main()
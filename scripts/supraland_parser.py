@@ -3,12 +3,6 @@ from os import environ
 from pathlib import Path
 from typing import Any, Optional
 
-from parserlib.localisation import export_class_loc, export_loc_files
-from parserlib.slmarkers import export_markers
-from parserlib.swmarkers import export_sw_markers
-from parserlib.swpreproc import preproc_levels
-from parserlib.swversion import update_swversion_info
-
 
 def main() -> None:
     parser = ArgumentParser()
@@ -25,6 +19,9 @@ def main() -> None:
         '-v', '--version', action='store_true', help='update version information (set source to install directory)'
     )
     parser.add_argument('-o', '--loc', action='store_true', help='extract required loc strings for game')
+    parser.add_argument(
+        '-j', '--jobs', type=int, help='processes reading level files for markers (default one per level up to CPUs)'
+    )
     args = parser.parse_args()
 
     # Grab source directory and cleanup slc differences
@@ -36,15 +33,25 @@ def main() -> None:
 
     datadir = Path(args.data)
     sourcedir = Path(sourcedir)
+    # Each command's modules are only imported when it is run, the marker exports need numpy, scipy
+    # and scikit-learn which take seconds to import and the other commands don't
     if args.preproc:
+        from parserlib.swpreproc import preproc_levels
+
         preproc_levels(game=args.game, datadir=datadir, sourcedir=sourcedir)
     elif args.markers:
         if args.game == 'sw':
+            from parserlib.swmarkers import export_sw_markers
+
             export_sw_markers(game=args.game, datadir=datadir, sourcedir=sourcedir)
         else:
-            export_markers(game=args.game, datadir=datadir, sourcedir=sourcedir)
+            from parserlib.slmarkers import export_markers
+
+            export_markers(game=args.game, datadir=datadir, sourcedir=sourcedir, jobs=args.jobs)
     elif args.version:
         if args.game == 'sw':
+            from parserlib.swversion import update_swversion_info
+
             if not args.source:
                 sourcedir = Path(environ.get('SWROOT'))
             update_swversion_info(
@@ -52,6 +59,8 @@ def main() -> None:
             )
     elif args.loc:
         # Read the blueprint files to get the keys we need and then process the loc strings
+        from parserlib.localisation import export_class_loc, export_loc_files
+
         export_class_loc(game=args.game, datadir=datadir, sourcedir=sourcedir)
         export_loc_files(game=args.game, datadir=datadir, sourcedir=sourcedir)
     else:
@@ -8,12 +8,9 @@ call export sw setup
 call export sw mapimg
 call export sw markers
 
-copy ..\source\sw\mapimg\swmapfog-ea.png ..\source\sw\mapimg\swmapfog.png
+copy ..\source\sw\mapimg\swmap.png ..\source\sw\mapimg\swmap-final.png
 
-call export sw applyfog
-
-move ..\source\sw\mapimg\swmap-fogged.png ..\source\sw\mapimg\swmap-final.png
-
-export sw gentiles
+:: Apply the same fog used to filter the markers while tiling
+export sw gentiles -m ..\source\sw\mapimg\swmapfog-ea.png
 
 endlocal
@@ -0,0 +1,30 @@
+from io import BytesIO
+from typing import Any, Optional
+
+from PIL import Image, features
+
+# Pillow format name, feature it depends on (if any) and extra save options for each tile format
+tile_formats: dict[str, tuple[str, Optional[str], dict[str, Any]]] = {
+    'png': ('PNG', None, {}),
+    'jpg': ('JPEG', None, {}),
+    'jpeg': ('JPEG', None, {}),
+    'webp': ('WEBP', 'webp', {'method': 6}),
+    'avif': ('AVIF', 'avif', {'speed': 6}),
+}
+
+# Note on quality: We were using about 75 but it comes out with lots of JPG compression artefacts
+# 95 is pretty much perfect. 85 is a fair compromise. Use benchencoders.py to compare formats
+default_quality = 85
+
+
+# Formats this install of Pillow can write (webp and avif depend on how it was built)
+def available_formats() -> list[str]:
+    return [format for format, (_, feature, _) in tile_formats.items() if not feature or features.check(feature)]
+
+
+# Encode a tile as it would be saved to a file with the format as its extension. Quality is ignored for png
+def encode_tile(tile: Image.Image, format: str = 'png', quality: int = default_quality) -> bytes:
+    name, _, options = tile_formats[format]
+    data = BytesIO()
+    tile.save(data, format=name, quality=quality, **options)
+    return data.getvalue()
@@ -0,0 +1,60 @@
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+
+# Fog of war mask multiplied into the map as it is tiled, the same as compositing it over the whole
+# map image first (magick map.png fog.png -compose Multiply -composite) without the full size
+# intermediate image. Only the first channel of the mask is used, as for the early access filter
+# (see load_ea_fog in parserlib/swmarkers.py) so the tiles hide exactly what the markers leave out.
+#
+# The mask is stretched over the whole source image so it needn't be the same size (eg the 2k
+# swmapfog-ea.png over an 8k map).
+class FogMask:
+    def __init__(self, path: Path, source_size: tuple[int, int]):
+        with Image.open(path) as image:
+            self.mask = image.getchannel(0)
+            self.mask.load()
+        self.source_size = source_size
+        self.scale = (self.mask.width / source_size[0], self.mask.height / source_size[1])
+
+    # The mask for a box of the source image (parts outside the source are left clear)
+    def crop(self, box: tuple[int, int, int, int]) -> np.ndarray:
+        left, top, right, bottom = box
+        width, height = self.source_size
+        mask = np.full((bottom - top, right - left), 255, dtype=np.uint8)
+
+        l, t, r, b = max(left, 0), max(top, 0), min(right, width), min(bottom, height)
+        if l < r and t < b:
+            sx, sy = self.scale
+            if self.mask.size == self.source_size:
+                region = self.mask.crop((l, t, r, b))
+            else:
+                region = self.mask.resize(
+                    (r - l, b - t), Image.Resampling.BILINEAR, box=(l * sx, t * sy, r * sx, b * sy)
+                )
+            mask[t - top : b - top, l - left : r - left] = np.asarray(region)
+        return mask
+
+    # Multiply the mask into a region cropped from box of the source (alpha is left alone)
+    def apply(self, region: Image.Image, box: tuple[int, int, int, int]) -> Image.Image:
+        mask = self.crop(box)
+        if mask.min() == 255:
+            return region
+
+        pixels = np.asarray(region).astype(np.uint16)
+        if pixels.ndim == 2:
+            pixels = pixels * mask
+        else:
+            bands = 3 if region.mode in ('RGB', 'RGBA') else 1
+            pixels[..., :bands] *= mask[..., np.newaxis]
+            pixels[..., bands:] *= 255
+        return Image.fromarray(((pixels + 127) // 255).astype(np.uint8))
+
+
+# Each worker process loads the mask once
+@lru_cache(maxsize=2)
+def load_fog(path: Path, source_size: tuple[int, int]) -> FogMask:
+    return FogMask(path, source_size)
@@ -0,0 +1,86 @@
+import json
+import os
+from hashlib import blake2b
+from pathlib import Path
+from typing import Any, Optional
+
+from PIL import Image
+
+# Bump this if the way tiles are produced changes so that existing tiles get regenerated
+manifest_version = 1
+
+
+# Hash of the source pixels a tile is produced from, salted with the options used to produce it
+def hash_image(salt: bytes, image: Image.Image) -> str:
+    h = blake2b(salt, digest_size=16)
+    h.update(f'{image.mode}:{image.size[0]}x{image.size[1]}:'.encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+# Hash of a tile built from other tiles (ie the pyramid levels), made from the hashes of those tiles
+def hash_tiles(salt: bytes, hashes: list[str]) -> str:
+    h = blake2b(salt, digest_size=16)
+    h.update(':'.join(hashes).encode())
+    return h.hexdigest()
+
+
+# Key identifying the pixels of a tile so identical tiles can be stored once. Tiles of a single colour
+# (most of the map background) are spotted from their extrema rather than hashing all the pixels
+def pixels_key(image: Image.Image) -> str:
+    extrema = image.getextrema()
+    if len(image.getbands()) == 1:
+        extrema = (extrema,)
+    if all(low == high for low, high in extrema):
+        color = ','.join(str(low) for low, _ in extrema)
+        return f'solid:{image.mode}:{image.size[0]}x{image.size[1]}:{color}'
+    h = blake2b(digest_size=16)
+    h.update(f'{image.mode}:{image.size[0]}x{image.size[1]}:'.encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+# Records the hash of the source region each tile in a tile set was produced from, so a rerun can
+# skip tiles whose source hasn't changed. Stored as {tiles}.manifest.json next to the tile directory
+# or archive (see the writers) unless gentiles is given somewhere else for it, never in with the tiles
+# as it would be published with them:
+#   {"params": {...}, "tiles": {"z/x/y": hash, ...}}
+#
+# The params are the options that change tile output other than the source (format, size...). If
+# they don't match those of the previous run then none of the previous hashes are used.
+class TileManifest:
+    def __init__(self, path: Path, params: dict[str, Any], force: bool = False):
+        self.path = path
+        self.params = {'version': manifest_version} | params
+        self.salt = json.dumps(self.params, sort_keys=True).encode()
+        self.previous = {}
+        self.tiles = {}
+
+        if not force and self.path.exists():
+            try:
+                data = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                data = {}
+            if data.get('params') == self.params:
+                self.previous = data.get('tiles', {})
+
+    # Hash recorded for a tile by the previous run (if any)
+    def get_previous(self, z: int, x: int, y: int) -> Optional[str]:
+        return self.previous.get(f'{z}/{x}/{y}')
+
+    # Hash recorded for a tile by this run
+    def get(self, z: int, x: int, y: int) -> Optional[str]:
+        return self.tiles.get(f'{z}/{x}/{y}')
+
+    def set(self, z: int, x: int, y: int, tile_hash: str) -> None:
+        self.tiles[f'{z}/{x}/{y}'] = tile_hash
+
+    # Write out the manifest, keeping entries for zoom levels not generated by this run. Written to a
+    # temporary file first so an interrupted run can't leave a truncated manifest behind
+    def save(self) -> None:
+        tiles = self.previous | self.tiles
+        data = {'params': self.params, 'tiles': dict(sorted(tiles.items()))}
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        temp_path = self.path.with_suffix('.tmp')
+        temp_path.write_text(json.dumps(data, indent=2))
+        os.replace(temp_path, self.path)
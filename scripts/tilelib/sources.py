@@ -0,0 +1,165 @@
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import numpy as np
+from PIL import Image
+
+# Image modes we can hold as a plain uint8 array and number of bands for each
+shareable_modes = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}
+
+# Binary netpbm formats (8 bit only) that RawImage can read in strips
+raw_suffixes = {'.ppm', '.pgm', '.pnm'}
+raw_magic_modes = {b'P5': 'L', b'P6': 'RGB'}
+
+
+# Source image whose decoded pixels live in a shared memory block so that tile worker processes can
+# crop from it without each one decoding (and holding) its own copy of a very large map image.
+#
+# Only the process that created the block (owner) unlinks it when closed, workers just detach.
+class SharedImage:
+    def __init__(self, shm: SharedMemory, mode: str, size: tuple[int, int], owner: bool = False):
+        self.shm = shm
+        self.mode = mode
+        self.size = size
+        self.owner = owner
+        width, height = size
+        bands = shareable_modes[mode]
+        shape = (height, width, bands) if bands > 1 else (height, width)
+        self.pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+    # Copy a decoded image into a new shared memory block. Rows are copied in strips so we never
+    # need a second full size copy of the image as an intermediate
+    @classmethod
+    def from_image(cls, image: Image.Image, strip_height: int = 1024) -> 'SharedImage':
+        width, height = image.size
+        shm = SharedMemory(create=True, size=max(1, width * height * shareable_modes[image.mode]))
+        shared = cls(shm=shm, mode=image.mode, size=image.size, owner=True)
+        for top in range(0, height, strip_height):
+            bottom = min(top + strip_height, height)
+            shared.pixels[top:bottom] = np.asarray(image.crop((0, top, width, bottom)))
+        return shared
+
+    # Arguments that can be passed to another process to attach to the same image
+    def spec(self) -> tuple[str, str, str, tuple[int, int]]:
+        return ('shared', self.shm.name, self.mode, self.size)
+
+    @classmethod
+    def attach(cls, name: str, mode: str, size: tuple[int, int]) -> 'SharedImage':
+        return cls(shm=SharedMemory(name=name), mode=mode, size=size)
+
+    # Same behaviour as Image.crop, including filling areas outside the source with zeros
+    def crop(self, box: tuple[int, int, int, int]) -> Image.Image:
+        return crop_pixels(self.pixels, self.size, box)
+
+    def close(self) -> None:
+        # The array has to be released before the shared memory buffer can be closed
+        self.pixels = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self) -> 'SharedImage':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+# Crop a box from the rows of an image held as a uint8 array, the first row of pixels being row y of the
+# image. Matches Image.crop by filling anything that falls outside the image with zeros
+def crop_pixels(pixels: np.ndarray, size: tuple[int, int], box: tuple[int, int, int, int], y: int = 0) -> Image.Image:
+    left, top, right, bottom = box
+    width, height = size
+    if left >= 0 and top >= 0 and right <= width and bottom <= height:
+        return Image.fromarray(pixels[top - y : bottom - y, left:right])
+
+    region = np.zeros((bottom - top, right - left) + pixels.shape[2:], dtype=np.uint8)
+    l, t, r, b = max(left, 0), max(top, 0), min(right, width), min(bottom, height)
+    if l < r and t < b:
+        region[t - top : b - top, l - left : r - left] = pixels[t - y : b - y, l:r]
+    return Image.fromarray(region)
+
+
+# Source image stored uncompressed in a binary PPM (RGB) or PGM (greyscale) file. Pixels are read from
+# the file as they are cropped so only the rows covering the current crop are ever in memory, which
+# lets us tile images that would be far too large to decode in one go. Convert a PNG with:
+#   magick {game}map-final.png {game}map-final.ppm
+class RawImage:
+    def __init__(self, path: Path, file: BinaryIO, mode: str, size: tuple[int, int], offset: int):
+        self.path = path
+        self.file = file
+        self.mode = mode
+        self.size = size
+        self.offset = offset
+        self.bands = shareable_modes[mode]
+
+    @classmethod
+    def open(cls, path: Path) -> 'RawImage':
+        file = path.open('rb')
+        try:
+            magic, width, height, maxval = cls.read_header(file)
+        except ValueError:
+            file.close()
+            raise
+        if magic not in raw_magic_modes or maxval > 255:
+            file.close()
+            raise ValueError(f'{path} is not an 8 bit binary PPM or PGM file')
+        return cls(path=path, file=file, mode=raw_magic_modes[magic], size=(width, height), offset=file.tell())
+
+    # Netpbm header is the magic number then width, height and maxval separated by whitespace (with
+    # optional # comments) and a single whitespace character before the pixel data
+    @staticmethod
+    def read_header(file: BinaryIO) -> tuple[bytes, int, int, int]:
+        fields = []
+        token = b''
+        while len(fields) < 4:
+            c = file.read(1)
+            if not c:
+                raise ValueError('unexpected end of netpbm header')
+            if c == b'#' and not token:
+                file.readline()
+            elif c.isspace():
+                if token:
+                    fields.append(token)
+                    token = b''
+            else:
+                token += c
+        try:
+            return fields[0], int(fields[1]), int(fields[2]), int(fields[3])
+        except ValueError:
+            raise ValueError('badly formed netpbm header')
+
+    # Arguments that can be passed to another process so it can open the same image
+    def spec(self) -> tuple[str, str]:
+        return ('raw', str(self.path))
+
+    # Read whole rows top to bottom (clamped to the image) as a uint8 array
+    def read_rows(self, top: int, bottom: int) -> np.ndarray:
+        width, height = self.size
+        top, bottom = max(top, 0), min(bottom, height)
+        row_bytes = width * self.bands
+        self.file.seek(self.offset + top * row_bytes)
+        pixels = np.fromfile(self.file, dtype=np.uint8, count=max(bottom - top, 0) * row_bytes)
+        return pixels.reshape((-1, width, self.bands) if self.bands > 1 else (-1, width))
+
+    # Same behaviour as Image.crop, only the rows in the box are read from the file
+    def crop(self, box: tuple[int, int, int, int]) -> Image.Image:
+        _, top, _, bottom = box
+        return crop_pixels(self.read_rows(top, bottom), self.size, box, y=max(top, 0))
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> 'RawImage':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+# Open an image that was shared by another process using its spec()
+def attach_image(spec: tuple) -> SharedImage | RawImage:
+    if spec[0] == 'raw':
+        return RawImage.open(Path(spec[1]))
+    return SharedImage.attach(*spec[1:])
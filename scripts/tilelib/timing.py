@@ -0,0 +1,114 @@
+import ctypes
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Any, Iterator
+
+
+# Peak resident set size of this process in bytes (0 if it can't be found)
+def peak_rss() -> int:
+    if sys.platform == 'win32':
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong)] + [
+                (name, ctypes.c_size_t)
+                for name in (
+                    'PeakWorkingSetSize',
+                    'WorkingSetSize',
+                    'QuotaPeakPagedPoolUsage',
+                    'QuotaPagedPoolUsage',
+                    'QuotaPeakNonPagedPoolUsage',
+                    'QuotaNonPagedPoolUsage',
+                    'PagefileUsage',
+                    'PeakPagefileUsage',
+                )
+            ]
+
+        counters = ProcessMemoryCounters(cb=ctypes.sizeof(ProcessMemoryCounters))
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return 0
+        return counters.PeakWorkingSetSize
+
+    import resource
+
+    # Reported in kilobytes on Linux but bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+# Time spent in each stage of producing tiles (crop, resize, encode...) and counts of what was done.
+# Workers fill one in for each batch of tiles and return it with the tiles to be merged into the totals.
+@dataclass
+class Timings:
+    stages: dict[str, float] = field(default_factory=dict)
+    counts: dict[str, int] = field(default_factory=dict)
+    peak_rss: int = 0  # largest peak RSS of the processes that did the work
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + perf_counter() - start
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, other: 'Timings') -> None:
+        for name, seconds in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, n in other.counts.items():
+            self.count(name, n)
+        self.peak_rss = max(self.peak_rss, other.peak_rss)
+
+    # Record the peak RSS of the current process before returning the timings
+    def finish(self) -> 'Timings':
+        self.peak_rss = max(self.peak_rss, peak_rss())
+        return self
+
+
+# Timings for a whole gentiles run, level by level, written out as JSON with --stats. Stage times
+# are summed over all the worker processes so with several jobs they add up to more than the
+# elapsed (wall clock) time of the level.
+class TileStats:
+    def __init__(self, **info: Any):
+        self.info = info
+        self.levels = []
+        self.start = perf_counter()
+
+    def add_level(self, zoom_level: int, seconds: float, timings: Timings) -> None:
+        tiles = timings.counts.get('tiles', 0)
+        self.levels.append(
+            {
+                'zoom_level': zoom_level,
+                'seconds': round(seconds, 4),
+                'tiles_per_second': round(tiles / seconds, 1) if seconds else None,
+                'counts': dict(sorted(timings.counts.items())),
+                'stages': {name: round(t, 4) for name, t in sorted(timings.stages.items())},
+                'peak_rss_worker': timings.peak_rss,
+            }
+        )
+
+    def to_json(self) -> dict[str, Any]:
+        seconds = perf_counter() - self.start
+        tiles = sum(level['counts'].get('tiles', 0) for level in self.levels)
+        stages = {}
+        for level in self.levels:
+            for name, t in level['stages'].items():
+                stages[name] = round(stages.get(name, 0.0) + t, 4)
+        return self.info | {
+            'levels': self.levels,
+            'total': {
+                'seconds': round(seconds, 4),
+                'tiles': tiles,
+                'tiles_per_second': round(tiles / seconds, 1) if seconds else None,
+                'stages': dict(sorted(stages.items())),
+            },
+            'peak_rss': {
+                'main': peak_rss(),
+                'workers': max((level['peak_rss_worker'] for level in self.levels), default=0),
+            },
+        }
@@ -0,0 +1,233 @@
+import os
+import re
+import sqlite3
+from hashlib import blake2b
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+# Suffix of output paths that are written as a single MBTiles archive rather than a directory of tiles
+mbtiles_suffix = '.mbtiles'
+
+# Tile formats whose name in the MBTiles metadata isn't the one we use (the file suffix of the tiles)
+mbtiles_formats = {'jpeg': 'jpg'}
+
+
+# Writes tiles into the standard slippy map directory structure:
+#   path/zoom_level/x/y{suffix}.format
+#
+# The suffix is for variants of the tiles stored alongside the main ones (eg y@2x.png, see TileWriter).
+#
+# With dedup set, a tile whose pixels key matches a tile already written by this run is stored as a
+# hard link to that tile's file rather than a copy of it (it falls back to a copy if links fail).
+class DirectoryWriter:
+    def __init__(self, path: Path, format: str = 'png', dedup: bool = False, suffix: str = ''):
+        self.path = path
+        self.format = format
+        self.dedup = dedup
+        self.suffix = suffix
+        self.written = {}  # pixels key -> path of first tile written with it
+        self.duplicates = 0  # count of duplicate tiles stored as links
+
+    # Where the TileManifest for these tiles lives, next to the directory rather than in it so it isn't
+    # published along with the tiles
+    @property
+    def manifest_path(self) -> Path:
+        return self.path.with_name(self.path.name + '.manifest.json')
+
+    def tile_path(self, z: int, x: int, y: int) -> Path:
+        return self.path.joinpath(f'{z}/{x}/{y}{self.suffix}.' + self.format)
+
+    # Create the directories for a zoom level and remove any of our tiles that aren't part of its grid
+    # (the rest are overwritten when they change)
+    def prepare_level(self, zoom_level: int) -> None:
+        num_tiles = 1 << zoom_level
+        for x in range(num_tiles):
+            self.path.joinpath(f'{zoom_level}/{x}').mkdir(exist_ok=True, parents=True)
+
+        expected = {self.tile_path(zoom_level, x, y) for x in range(num_tiles) for y in range(num_tiles)}
+        name = re.compile('[0-9]+' + re.escape(self.suffix))
+        for child in self.path.joinpath(str(zoom_level)).rglob('*.' + self.format):
+            if child not in expected and name.fullmatch(child.stem):
+                child.unlink()
+
+    def exists(self, z: int, x: int, y: int) -> bool:
+        return self.tile_path(z, x, y).exists()
+
+    def write(self, z: int, x: int, y: int, data: bytes, key: Optional[str] = None) -> None:
+        path = self.tile_path(z, x, y)
+
+        # Remove the old file rather than writing over it as it may be linked to other (unchanged) tiles
+        path.unlink(missing_ok=True)
+
+        if self.dedup and (original := self.written.get(key)):
+            try:
+                os.link(original, path)
+                self.duplicates += 1
+                return
+            except OSError:
+                pass
+
+        path.write_bytes(data)
+        if key:
+            self.written.setdefault(key, path)
+
+    def close(self) -> None:
+        pass
+
+
+# Writes tiles into a single MBTiles (SQLite) archive, https://github.com/mapbox/mbtiles-spec
+#
+# Uses the deduplicating layout: the map table holds the id of the image for each tile, keyed by
+# z/x/y so looking up or replacing a tile is a single index probe, and the images table holds each
+# distinct encoded tile once (keyed by a hash of its bytes). The tiles view gives the standard schema.
+#
+# Note MBTiles rows count up from the bottom (TMS) so tile_row is flipped relative to the y we use.
+#
+# An archive only holds one tile per z/x/y so variants (see TileWriter) each get their own archive
+# with the suffix added to the name, eg swmap@2x.mbtiles.
+class MBTilesWriter:
+    schema = """
+        CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS map (
+            zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT,
+            PRIMARY KEY (zoom_level, tile_column, tile_row)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB);
+        CREATE VIEW IF NOT EXISTS tiles AS
+            SELECT zoom_level, tile_column, tile_row, tile_data FROM map JOIN images USING (tile_id);
+    """
+
+    def __init__(self, path: Path, format: str = 'png', dedup: bool = True, suffix: str = ''):
+        path = path.with_name(path.stem + suffix + path.suffix)
+        self.path = path
+        self.format = format
+        self.dedup = dedup  # identical tiles are always stored once, this is only here to match DirectoryWriter
+        self.duplicates = 0  # count of tiles sharing an image already in the archive
+        path.parent.mkdir(exist_ok=True, parents=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.schema)
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.path.with_suffix('.manifest.json')
+
+    # Remove any tiles outside the grid of a zoom level. Also commits the tiles written so far (the
+    # previous level) so the archive is up to date whenever the manifest is saved
+    def prepare_level(self, zoom_level: int) -> None:
+        num_tiles = 1 << zoom_level
+        self.db.execute(
+            'DELETE FROM map WHERE zoom_level = ? AND (tile_column >= ? OR tile_row >= ?)',
+            (zoom_level, num_tiles, num_tiles),
+        )
+        self.db.commit()
+
+    def exists(self, z: int, x: int, y: int) -> bool:
+        row = self.db.execute(
+            'SELECT 1 FROM map WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', (z, x, (1 << z) - 1 - y)
+        )
+        return row.fetchone() is not None
+
+    def write(self, z: int, x: int, y: int, data: bytes, key: Optional[str] = None) -> None:
+        tile_id = blake2b(data, digest_size=16).hexdigest()
+        if self.db.execute('INSERT OR IGNORE INTO images VALUES (?, ?)', (tile_id, data)).rowcount == 0:
+            self.duplicates += 1
+        self.db.execute('INSERT OR REPLACE INTO map VALUES (?, ?, ?, ?)', (z, x, (1 << z) - 1 - y, tile_id))
+
+    # Drop images no tile uses any more (replaced tiles) and fill in the metadata from what's in the archive
+    def close(self) -> None:
+        self.db.execute('DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)')
+        zoom_min, zoom_max = self.db.execute('SELECT MIN(zoom_level), MAX(zoom_level) FROM map').fetchone()
+        metadata = {
+            'name': self.path.stem,
+            'type': 'baselayer',
+            'format': mbtiles_formats.get(self.format, self.format),
+        }
+        if zoom_min is not None:
+            metadata |= {'minzoom': str(zoom_min), 'maxzoom': str(zoom_max)}
+        self.db.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?)', metadata.items())
+        self.db.commit()
+        self.db.close()
+
+
+# Reads the tiles of an MBTiles archive (see MBTilesWriter), opening it read only so the archive is
+# left as it is. The tile format is taken from its metadata.
+class MBTilesReader:
+    def __init__(self, path: Path):
+        if not path.is_file():
+            raise FileNotFoundError(f'{path} does not exist')
+        self.path = path
+        self.db = sqlite3.connect(path.resolve().as_uri() + '?mode=ro', uri=True)
+        try:
+            tables = {name for (name,) in self.db.execute('SELECT name FROM sqlite_master')}
+        except sqlite3.DatabaseError as e:
+            self.db.close()
+            raise ValueError(f'{path} is not an MBTiles archive ({e})') from e
+        if not {'metadata', 'tiles'} <= tables:
+            self.db.close()
+            raise ValueError(f'{path} is not an MBTiles archive (no metadata and tiles tables)')
+        format = self.metadata().get('format', 'png')
+        self.format = next((ours for ours, theirs in mbtiles_formats.items() if theirs == format), format)
+
+    def metadata(self) -> dict[str, str]:
+        return dict(self.db.execute('SELECT name, value FROM metadata'))
+
+    # Tile at z/x/y (None if there isn't one)
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        row = self.db.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+            (z, x, (1 << z) - 1 - y),
+        ).fetchone()
+        return row[0] if row else None
+
+    # All the tiles in the archive as z, x, y, data
+    def tiles(self, zoom_levels: Optional[tuple[int, int]] = None) -> Iterator[tuple[int, int, int, bytes]]:
+        zoom_min, zoom_max = zoom_levels or (0, 1 << 30)
+        rows = self.db.execute(
+            'SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles WHERE zoom_level BETWEEN ? AND ?',
+            (zoom_min, zoom_max),
+        )
+        for z, x, row, data in rows:
+            yield z, x, (1 << z) - 1 - row, data
+
+    def close(self) -> None:
+        self.db.close()
+
+
+# Writer for an output path, archives are picked by the file suffix
+def open_writer(
+    path: Path, format: str = 'png', dedup: bool = False, suffix: str = ''
+) -> DirectoryWriter | MBTilesWriter:
+    if path.suffix.lower() == mbtiles_suffix:
+        return MBTilesWriter(path, format=format, dedup=dedup, suffix=suffix)
+    return DirectoryWriter(path, format=format, dedup=dedup, suffix=suffix)
+
+
+# Writes all the variants of each tile (eg the normal and @2x retina tiles) to an output path, each
+# variant with its own writer. The variant without a suffix is the main one, the manifest goes with it.
+class TileWriter:
+    def __init__(self, path: Path, format: str = 'png', dedup: bool = False, suffixes: Iterable[str] = ('',)):
+        self.dedup = dedup
+        self.writers = {suffix: open_writer(path, format=format, dedup=dedup, suffix=suffix) for suffix in suffixes}
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.writers[''].manifest_path
+
+    @property
+    def duplicates(self) -> int:
+        return sum(writer.duplicates for writer in self.writers.values())
+
+    def prepare_level(self, zoom_level: int) -> None:
+        for writer in self.writers.values():
+            writer.prepare_level(zoom_level)
+
+    # A tile only exists if all its variants do
+    def exists(self, z: int, x: int, y: int) -> bool:
+        return all(writer.exists(z, x, y) for writer in self.writers.values())
+
+    def write(self, z: int, x: int, y: int, data: bytes, key: Optional[str] = None, suffix: str = '') -> None:
+        self.writers[suffix].write(z, x, y, data, key)
+
+    def close(self) -> None:
+        for writer in self.writers.values():
+            writer.close()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Unpack a tile archive written by gentiles.py into the slippy map directory structure:
+    output_folder/zoom_level/x/y.format
+
+eg: uv run unpacktiles.py swmap.mbtiles ..\\public\\tiles\\sw\\base
+"""
+
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Optional
+
+from gentiles import retina_suffix, zoom_range_type
+from tilelib.writers import DirectoryWriter, MBTilesReader
+
+
+def unpack(archive: MBTilesReader, writer: DirectoryWriter, zoom_levels: Optional[tuple[int, int]] = None) -> int:
+    """
+    writes the tiles of an archive through a directory writer, returning how many there were
+    """
+    count = 0
+    levels = set()
+    for z, x, y, data in archive.tiles(zoom_levels):
+        if z not in levels:
+            writer.prepare_level(z)
+            levels.add(z)
+        writer.write(z, x, y, data)
+        count += 1
+    return count
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Unpack a .mbtiles tile archive to a directory of tiles')
+    parser.add_argument('archive', type=Path, help='.mbtiles archive to unpack')
+    parser.add_argument('output_folder', type=Path, help='folder to write the tiles to')
+    parser.add_argument('-z', '--zoom_level', type=zoom_range_type, help='only unpack these zoom level(s), eg 2-4')
+    args = parser.parse_args()
+
+    try:
+        archive = MBTilesReader(args.archive)
+    except (FileNotFoundError, ValueError) as e:
+        print(f'error: {e}')
+        sys.exit(1)
+
+    try:
+        # Variant archives (eg swmap@2x.mbtiles) unpack alongside the main tiles with the same suffix
+        suffix = retina_suffix if args.archive.stem.endswith(retina_suffix) else ''
+        writer = DirectoryWriter(args.output_folder, format=archive.format, suffix=suffix)
+        count = unpack(archive, writer, args.zoom_level)
+    finally:
+        archive.close()
+    print(f'{count} tiles written to {args.output_folder}')
+
+
+if __name__ == '__main__':
+    main()